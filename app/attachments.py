@@ -0,0 +1,103 @@
+import asyncio
+import contextlib
+import os
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.metrics import metrics
+from database.models import Attachment
+
+
+def _remove(path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def claim_blob(
+    directory: str,
+    partial_path: str,
+    sha256: str,
+    ext: str,
+    size: int,
+    content_type: str | None,
+) -> str:
+    """Add a reference to the blob with this hash and return its filename.
+
+    ``partial_path`` holds the bytes just received: it becomes the stored
+    file if the blob is new and is thrown away if it is already known.
+    """
+    with SessionLocal() as db:
+        while True:
+            filename = db.execute(
+                update(Attachment)
+                .where(Attachment.directory == directory, Attachment.sha256 == sha256)
+                .values(ref_count=Attachment.ref_count + 1)
+                .returning(Attachment.filename)
+            ).scalar()
+            if filename is not None:
+                db.commit()
+                _remove(partial_path)
+                metrics.incr("attachments.dedup_hits")
+                return filename
+
+            filename = f"{sha256}{ext}"
+            try:
+                db.execute(
+                    insert(Attachment).values(
+                        directory=directory,
+                        sha256=sha256,
+                        filename=filename,
+                        size=size,
+                        content_type=content_type,
+                        ref_count=1,
+                    )
+                )
+            except IntegrityError:
+                # Someone stored the same bytes first; reference theirs
+                db.rollback()
+                continue
+            os.replace(partial_path, os.path.join(directory, filename))
+            db.commit()
+            metrics.incr("attachments.stored")
+            return filename
+
+
+def release_blob(directory: str, filename: str):
+    """Drop one reference; the file is deleted along with its last one."""
+    path = os.path.join(directory, filename)
+    with SessionLocal() as db:
+        remaining = db.execute(
+            update(Attachment)
+            .where(Attachment.directory == directory, Attachment.filename == filename)
+            .values(ref_count=Attachment.ref_count - 1)
+            .returning(Attachment.ref_count)
+        ).scalar()
+        if remaining is None:
+            # Uploaded before attachments were tracked, so it has one owner
+            _remove(path)
+        elif remaining <= 0:
+            db.execute(
+                delete(Attachment).where(
+                    Attachment.directory == directory,
+                    Attachment.filename == filename,
+                    Attachment.ref_count <= 0,
+                )
+            )
+            _remove(path)
+        db.commit()
+
+
+def thumbnails_of(directory: str, filename):
+    """The thumbnails recorded for a stored file, as a column for any query
+    that selects the file's name."""
+    return (
+        select(Attachment.thumbnails)
+        .where(Attachment.directory == directory, Attachment.filename == filename)
+        .scalar_subquery()
+    )
+
+
+async def release_attachment(directory: str, filename: str):
+    await asyncio.to_thread(release_blob, directory, filename)
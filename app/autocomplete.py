@@ -0,0 +1,136 @@
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.config import AUTOCOMPLETE_REFRESH_SECONDS
+from app.metrics import metrics
+from database.models import Chatroom, User
+
+
+class PrefixIndex:
+    """Lowercased names kept in one sorted list, with the ids they belong to
+    in a parallel list; a prefix lookup is a bisect plus a short scan."""
+
+    def __init__(self):
+        self._keys: list[str] = []
+        self._ids: list[int] = []
+        self._entries: dict[int, tuple[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def load(self, items):
+        """Replace the contents with ``(id, name, payload)`` items."""
+        entries = {id: (name.lower(), payload) for id, name, payload in items}
+        ordered = sorted((key, id) for id, (key, _) in entries.items())
+        with self._lock:
+            self._keys = [key for key, _ in ordered]
+            self._ids = [id for _, id in ordered]
+            self._entries = entries
+
+    def add(self, id: int, name: str, payload: dict):
+        key = name.lower()
+        with self._lock:
+            self._discard(id)
+            position = bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._ids.insert(position, id)
+            self._entries[id] = (key, payload)
+
+    def remove(self, id: int):
+        with self._lock:
+            self._discard(id)
+
+    def _discard(self, id: int):
+        entry = self._entries.pop(id, None)
+        if entry is None:
+            return
+        position = bisect_left(self._keys, entry[0])
+        while self._ids[position] != id:
+            position += 1
+        del self._keys[position]
+        del self._ids[position]
+
+    def search(self, prefix: str, limit: int) -> list[dict]:
+        prefix = prefix.lower()
+        results = []
+        with self._lock:
+            position = bisect_left(self._keys, prefix)
+            while (
+                len(results) < limit
+                and position < len(self._keys)
+                and self._keys[position].startswith(prefix)
+            ):
+                results.append(self._entries[self._ids[position]][1])
+                position += 1
+        return results
+
+
+def user_entry(user) -> tuple[int, str, dict]:
+    return (
+        user.id,
+        user.username,
+        {
+            "id": user.id,
+            "username": user.username,
+            "full_name": f"{user.first_name} {user.last_name}",
+        },
+    )
+
+
+def room_entry(room) -> tuple[int, str, dict]:
+    return room.id, room.roomname, {"id": room.id, "roomname": room.roomname}
+
+
+class Autocomplete:
+    """Prefix indexes of usernames and room names for typeahead.
+
+    Loaded from the database on first use, then kept current by the routes
+    that register users, edit profiles and create or rename rooms. A full
+    reload every ``refresh_seconds`` picks up changes made by other workers.
+    """
+
+    def __init__(self, refresh_seconds: float = AUTOCOMPLETE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.users = PrefixIndex()
+        self.rooms = PrefixIndex()
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    def _stale(self) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.refresh_seconds
+        )
+
+    def ensure_loaded(self, db: Session):
+        if not self._stale():
+            return
+        with self._lock:
+            if not self._stale():
+                return
+            users = db.execute(
+                select(User.id, User.username, User.first_name, User.last_name)
+            ).all()
+            rooms = db.execute(select(Chatroom.id, Chatroom.roomname)).all()
+            self.users.load(user_entry(user) for user in users)
+            self.rooms.load(room_entry(room) for room in rooms)
+            self._loaded_at = time.monotonic()
+        metrics.set_gauge("autocomplete.users", len(self.users))
+        metrics.set_gauge("autocomplete.rooms", len(self.rooms))
+
+    def add_user(self, user):
+        # Before the first load there is nothing to keep current
+        if self._loaded_at is not None:
+            self.users.add(*user_entry(user))
+
+    def add_room(self, room):
+        if self._loaded_at is not None:
+            self.rooms.add(*room_entry(room))
+
+
+autocomplete = Autocomplete()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+
+from app.config import BACKPLANE, BACKPLANE_CHANNEL, DATABASE_URL
+from app.frames import Frame
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, Frame], None]
+
+# NOTIFY payloads are capped at 8000 bytes by PostgreSQL
+PG_NOTIFY_MAX_PAYLOAD = 7999
+# Channels are "room:..." or "dm:...", so this prefix cannot clash with one
+CHUNK_PREFIX = "chunk:"
+# Room for the chunk header in front of each part
+CHUNK_HEADER_RESERVE = 64
+
+
+def split_utf8(data: bytes, size: int) -> list[str]:
+    """Split encoded text into pieces of at most ``size`` bytes.
+
+    Cuts never fall inside a multi-byte character, so each piece decodes on
+    its own.
+    """
+    parts = []
+    start = 0
+    while start < len(data):
+        end = min(start + size, len(data))
+        # Continuation bytes look like 0b10xxxxxx
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode())
+        start = end
+    return parts
+
+
+class Backplane(ABC):
+    """Pub/sub bus that carries room and DM frames between worker processes.
+
+    Managers publish every event and deliver to their local sockets only from
+    the subscription callback, so a frame reaches the sockets of every worker,
+    including the one that published it.
+    """
+
+    def __init__(self):
+        self._handlers: list[Handler] = []
+
+    def subscribe(self, handler: Handler):
+        self._handlers.append(handler)
+
+    @abstractmethod
+    async def start(self):
+        """Open whatever connections the transport needs."""
+
+    @abstractmethod
+    async def stop(self):
+        """Close the transport's connections."""
+
+    @abstractmethod
+    async def publish(self, channel: str, frame: Frame):
+        """Send a frame to the subscribers of every worker."""
+
+    def dispatch(self, channel: str, frame: Frame):
+        for handler in self._handlers:
+            try:
+                handler(channel, frame)
+            except Exception:
+                logger.exception("Backplane handler failed for %s", channel)
+
+
+class InMemoryHub:
+    def __init__(self):
+        self.members: list[InMemoryBackplane] = []
+
+
+class InMemoryBackplane(Backplane):
+    """Single-process backplane; instances sharing a hub behave like workers."""
+
+    def __init__(self, hub: InMemoryHub | None = None):
+        super().__init__()
+        self.hub = hub or InMemoryHub()
+        self.hub.members.append(self)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, frame: Frame):
+        for member in self.hub.members:
+            member.dispatch(channel, frame)
+
+
+class PostgresBackplane(Backplane):
+    """Backplane over PostgreSQL LISTEN/NOTIFY.
+
+    Each payload is ``"<channel>\\n<frame text>"`` so the frame is forwarded
+    without being decoded and re-encoded. Payloads over the NOTIFY limit are
+    sent as ``"chunk:<id>:<index>:<count>\\n<part>"`` notifications in one
+    transaction, which PostgreSQL delivers together and in order.
+    """
+
+    def __init__(self, dsn: str, pg_channel: str = BACKPLANE_CHANNEL):
+        super().__init__()
+        self.dsn = dsn
+        self.pg_channel = pg_channel
+        self._listener = None
+        self._pool = None
+        # Parts of chunked payloads received so far, by chunk id
+        self._partial: dict[str, list[str | None]] = {}
+
+    async def start(self):
+        import asyncpg
+
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+        await self._listen()
+
+    async def _listen(self):
+        import asyncpg
+
+        # Chunks cut off by a lost connection will never be completed
+        self._partial.clear()
+        self._listener = await asyncpg.connect(self.dsn)
+        self._listener.add_termination_listener(self._on_terminated)
+        await self._listener.add_listener(self.pg_channel, self._on_notify)
+
+    def _on_terminated(self, _connection):
+        logger.warning("Backplane listener connection lost, reconnecting")
+        asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 0.5
+        while self._pool is not None:
+            try:
+                await self._listen()
+                return
+            except Exception:
+                logger.exception("Backplane reconnect failed")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _on_notify(self, _connection, _pid, _pg_channel, payload: str):
+        channel, _, text = payload.partition("\n")
+        if channel.startswith(CHUNK_PREFIX):
+            payload = self._add_chunk(channel.removeprefix(CHUNK_PREFIX), text)
+            if payload is None:
+                return
+            channel, _, text = payload.partition("\n")
+        self.dispatch(channel, Frame(text))
+
+    def _add_chunk(self, header: str, part: str) -> str | None:
+        chunk_id, index, count = header.split(":")
+        parts = self._partial.setdefault(chunk_id, [None] * int(count))
+        parts[int(index)] = part
+        if any(part is None for part in parts):
+            return None
+        del self._partial[chunk_id]
+        return "".join(parts)
+
+    async def stop(self):
+        pool, self._pool = self._pool, None
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        if pool is not None:
+            await pool.close()
+
+    async def publish(self, channel: str, frame: Frame):
+        payload = f"{channel}\n{frame.text}"
+        data = payload.encode()
+        try:
+            if len(data) <= PG_NOTIFY_MAX_PAYLOAD:
+                await self._pool.execute(
+                    "SELECT pg_notify($1, $2)", self.pg_channel, payload
+                )
+            else:
+                metrics.incr("backplane.chunked_publishes")
+                await self._publish_chunks(data)
+        except Exception:
+            logger.exception("Backplane publish failed, delivering locally")
+            metrics.incr("backplane.publish_errors")
+            self.dispatch(channel, frame)
+
+    async def _publish_chunks(self, data: bytes):
+        chunk_id = uuid.uuid4().hex
+        parts = split_utf8(data, PG_NOTIFY_MAX_PAYLOAD - CHUNK_HEADER_RESERVE)
+        async with self._pool.acquire() as connection, connection.transaction():
+            for index, part in enumerate(parts):
+                await connection.execute(
+                    "SELECT pg_notify($1, $2)",
+                    self.pg_channel,
+                    f"{CHUNK_PREFIX}{chunk_id}:{index}:{len(parts)}\n{part}",
+                )
+
+
+def create_backplane() -> Backplane:
+    if BACKPLANE == "postgres":
+        # asyncpg takes a plain libpq URL, without the SQLAlchemy driver suffix
+        scheme, rest = DATABASE_URL.split("://", 1)
+        return PostgresBackplane(f"{scheme.split('+')[0]}://{rest}")
+    return InMemoryBackplane()
+
+
+backplane = create_backplane()
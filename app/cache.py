@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import metrics
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire ``ttl`` seconds after they are set."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._data.move_to_end(key)
+                metrics.incr(f"cache.{self.name}.hits")
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[key]
+        metrics.incr(f"cache.{self.name}.misses")
+        return default
+
+    def peek(self, key, default=None):
+        # Like get(), without touching LRU order or hit/miss counters
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            metrics.set_gauge(f"cache.{self.name}.size", len(self._data))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -5,6 +5,68 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Defaults to DATABASE_URL with an asyncpg / aiosqlite driver
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+# Lets clients reconnect to a private room without resending its password
+ROOM_TICKET_EXPIRE_MINUTES = int(os.getenv("ROOM_TICKET_EXPIRE_MINUTES", 30))
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 200))
+HOME_PAGE_SIZE = int(os.getenv("HOME_PAGE_SIZE", 50))
+HOME_MAX_PAGE_SIZE = int(os.getenv("HOME_MAX_PAGE_SIZE", 200))
+ROOMS_PAGE_SIZE = int(os.getenv("ROOMS_PAGE_SIZE", 50))
+ROOMS_MAX_PAGE_SIZE = int(os.getenv("ROOMS_MAX_PAGE_SIZE", 200))
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", 100))
+USERS_MAX_PAGE_SIZE = int(os.getenv("USERS_MAX_PAGE_SIZE", 1000))
+# Rows fetched per round trip when streaming the user directory
+USERS_STREAM_BATCH = int(os.getenv("USERS_STREAM_BATCH", 1000))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", 100))
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+
+# "memory" keeps fan-out in this process, "postgres" uses LISTEN/NOTIFY
+BACKPLANE = os.getenv("BACKPLANE", "memory")
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "chat_events")
+# Each worker re-announces who is online through it this often; a worker not
+# heard from for three intervals is taken to be gone
+PRESENCE_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", 30))
+
+# Group commit window for chat message inserts
+MESSAGE_FLUSH_MS = float(os.getenv("MESSAGE_FLUSH_MS", 5))
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 200))
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", 300))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", 5000))
+
+# Typeahead over usernames and room names; reloaded in full this often so
+# changes made by other workers show up
+AUTOCOMPLETE_REFRESH_SECONDS = float(os.getenv("AUTOCOMPLETE_REFRESH_SECONDS", 600))
+
+# bcrypt runs in its own processes; queued jobs beyond the limit get a 503
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", 64))
+PASSWORD_POOL_TIMEOUT = float(os.getenv("PASSWORD_POOL_TIMEOUT", 5))
+
+# Chat file uploads; clients are told to send binary frames of UPLOAD_CHUNK_SIZE
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 256 * 1024))
+# Profile and group images
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", 10 * 1024 * 1024))
+
+# Longest edge, in pixels, of each generated thumbnail; the first is the one
+# history payloads carry
+THUMBNAIL_SIZES = tuple(
+    int(size) for size in os.getenv("THUMBNAIL_SIZES", "200,800").split(",")
+)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+THUMBNAIL_QUEUE_SIZE = int(os.getenv("THUMBNAIL_QUEUE_SIZE", 1000))
+
+# Uploaded files never change under the same name
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 365 * 24 * 3600))
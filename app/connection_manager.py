@@ -1,63 +1,231 @@
+import asyncio
+import contextlib
+import time
+from abc import ABC, abstractmethod
+
 from fastapi import WebSocket
-from typing import Dict, Tuple, List, Union
-import json
 
-class ConnectionManager:
-    def __init__(self):
-        self.rooms_active_user: dict[int, list[WebSocket]] = {}
+from app.backplane import Backplane
+from app.config import WS_SEND_QUEUE_SIZE
+from app.frames import Frame
+from app.metrics import metrics
+from app.presence import RoomPresence
+
+# Policy violation is the closest standard code for "could not keep up"
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+
+class Connection:
+    """A socket with a bounded outbound queue drained by its own writer task."""
+
+    __slots__ = (
+        "websocket",
+        "user_id",
+        "connected_at",
+        "subscriptions",
+        "queue",
+        "closed",
+        "writer",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        subscriptions: set[tuple[str, int]],
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.connected_at = time.time()
+        # ("room", room_id) and/or ("dm", peer_id)
+        self.subscriptions = subscriptions
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self.writer = asyncio.create_task(self._drain())
+
+    def offer(self, frame: Frame) -> bool:
+        # Never waits: a full queue means the client is not keeping up.
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def send(self, frame: Frame):
+        # Direct replies go through the same queue as broadcasts so they stay
+        # ordered; never waiting on it means a dead or stopped writer cannot
+        # block the caller, and a full queue is a slow consumer like any other.
+        if self.offer(frame) or self.closed:
+            return
+        metrics.incr("ws.slow_consumer_disconnects")
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def _drain(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                await self.websocket.send_text(frame.text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Dead socket: stop writing, the receive loop will notice the close.
+            self.closed = True
+
+    async def close(self, code: int = 1000):
+        self.stop()
+        with contextlib.suppress(Exception):
+            await self.websocket.close(code=code)
+
+    def stop(self):
+        self.closed = True
+        if not self.writer.done():
+            self.writer.cancel()
+
+
+class ConnectionRegistry:
+    """Live connections indexed by room, by user and by (user, peer) pair."""
 
-    async def connect(self, websocket: WebSocket, roomid: int):
-        await websocket.accept()
-        if roomid not in self.rooms_active_user:
-            self.rooms_active_user[roomid] = []
-        self.rooms_active_user[roomid].append(websocket)
-
-    async def brodcast(self, msg: str, roomid: int):
-        if roomid in self.rooms_active_user:
-            for user in self.rooms_active_user[roomid]:
-                await user.send_text(msg)
-
-    def disconnect(self, websocket: WebSocket, roomid: int):
-        if roomid in self.rooms_active_user:
-            self.rooms_active_user[roomid].remove(websocket)
-            if not self.rooms_active_user[roomid]:
-                del self.rooms_active_user[roomid]
-
-class UserConnectionManager:
     def __init__(self):
-        # user_id -> list of (receiver_id, websocket) connections
-        self.active_user: Dict[int, List[Tuple[int, WebSocket]]] = {}
-    
-    async def connect(self,sender_id : int, receiver_id : int, websocket: WebSocket):
+        self.by_room: dict[int, set[Connection]] = {}
+        self.by_user: dict[int, set[Connection]] = {}
+        self.by_pair: dict[tuple[int, int], set[Connection]] = {}
+
+    def add(self, connection: Connection):
+        self.by_user.setdefault(connection.user_id, set()).add(connection)
+        for index, key in self._keys(connection):
+            index.setdefault(key, set()).add(connection)
+
+    def remove(self, connection: Connection):
+        self._discard(self.by_user, connection.user_id, connection)
+        for index, key in self._keys(connection):
+            self._discard(index, key, connection)
+
+    def room(self, room_id: int) -> set[Connection]:
+        return self.by_room.get(room_id, set())
+
+    def user(self, user_id: int) -> set[Connection]:
+        return self.by_user.get(user_id, set())
+
+    def pair(self, user_id: int, peer_id: int) -> set[Connection]:
+        return self.by_pair.get((user_id, peer_id), set())
+
+    def _keys(self, connection: Connection):
+        for kind, target in connection.subscriptions:
+            if kind == "room":
+                yield self.by_room, target
+            elif kind == "dm":
+                yield self.by_pair, (connection.user_id, target)
+
+    @staticmethod
+    def _discard(index: dict, key, connection: Connection):
+        connections = index.get(key)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del index[key]
+
+
+registry = ConnectionRegistry()
+
+
+class BaseConnectionManager(ABC):
+    def __init__(self, backplane: Backplane, registry: ConnectionRegistry = registry):
+        self.backplane = backplane
+        self.registry = registry
+        self._closing: set[asyncio.Task] = set()
+        backplane.subscribe(self.on_event)
+
+    @abstractmethod
+    def on_event(self, channel: str, frame: Frame):
+        """Deliver a backplane event to the matching local sockets."""
+
+    async def register(
+        self, websocket: WebSocket, user_id: int, subscription: tuple[str, int]
+    ) -> Connection:
         await websocket.accept()
-        if sender_id not in self.active_user:
-            self.active_user[sender_id] = []
-        self.active_user[sender_id].append((receiver_id, websocket))
-
-    async def send_msg(self, sender_id: int, receiver_id: int, msg: Union[str, dict]):
-        if isinstance(msg, dict):
-            msg = json.dumps(msg)  # convert dict to JSON string
-
-        # Send to receiver if connected
-        if receiver_id in self.active_user:
-            for receiver, websocket in self.active_user[receiver_id]:
-                if receiver == sender_id:
-                    await websocket.send_text(msg)
-
-        # Optionally: also send to sender if connected (e.g., for delivery status)
-        if sender_id in self.active_user:
-            for receiver, websocket in self.active_user[sender_id]:
-                if receiver == receiver_id:
-                    await websocket.send_text(msg)
-
-    async def disconnect(self, sender_id: int, receiver_id: int, websocket: WebSocket):
-        if sender_id in self.active_user:
-            # Filter out the exact (receiver_id, websocket) pair
-            self.active_user[sender_id] = [
-                (rid, ws) for (rid, ws) in self.active_user[sender_id]
-                if not (rid == receiver_id and ws == websocket)
-            ]
-
-            # If sender has no more connections, remove the sender
-            if not self.active_user[sender_id]:
-                del self.active_user[sender_id]
+        connection = Connection(websocket, user_id, {subscription})
+        self.registry.add(connection)
+        return connection
+
+    def deliver(self, connections: set[Connection], frame: Frame):
+        # Enqueue only, so one slow or dead client cannot delay the others.
+        for connection in tuple(connections):
+            if connection.offer(frame):
+                continue
+            if not connection.closed:
+                metrics.incr("ws.slow_consumer_disconnects")
+                self._close_later(connection, SLOW_CONSUMER_CLOSE_CODE)
+            self.disconnect(connection)
+
+    def _close_later(self, connection: Connection, code: int):
+        task = asyncio.create_task(connection.close(code=code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def disconnect(self, connection: Connection):
+        connection.stop()
+        self.registry.remove(connection)
+
+
+class ConnectionManager(BaseConnectionManager):
+    def __init__(
+        self,
+        backplane: Backplane,
+        presence: RoomPresence,
+        registry: ConnectionRegistry = registry,
+    ):
+        super().__init__(backplane, registry)
+        self.presence = presence
+
+    async def connect(
+        self, websocket: WebSocket, roomid: int, user_id: int
+    ) -> Connection:
+        connection = await self.register(websocket, user_id, ("room", roomid))
+        self.presence.join(roomid, user_id)
+        return connection
+
+    def disconnect(self, connection: Connection):
+        # Sockets can be disconnected twice (slow consumer, then the receive
+        # loop ending); only the first counts against presence
+        for kind, roomid in connection.subscriptions:
+            if kind == "room" and connection in self.registry.room(roomid):
+                self.presence.leave(roomid, connection.user_id)
+        super().disconnect(connection)
+
+    async def brodcast(self, frame: Frame, roomid: int):
+        await self.backplane.publish(f"room:{roomid}", frame)
+
+    def on_event(self, channel: str, frame: Frame):
+        kind, _, roomid = channel.partition(":")
+        if kind == "room":
+            self.deliver(self.registry.room(int(roomid)), frame)
+
+    async def close_user_sockets(self, user_id: int, roomid: int, code: int = 1000):
+        # e.g. after the user left the room: drop every socket they hold on it
+        for connection in tuple(self.registry.user(user_id)):
+            if ("room", roomid) in connection.subscriptions:
+                self.disconnect(connection)
+                await connection.close(code=code)
+
+
+class UserConnectionManager(BaseConnectionManager):
+    async def connect(
+        self, sender_id: int, receiver_id: int, websocket: WebSocket
+    ) -> Connection:
+        return await self.register(websocket, sender_id, ("dm", receiver_id))
+
+    async def send_msg(self, sender_id: int, receiver_id: int, frame: Frame):
+        await self.backplane.publish(f"dm:{sender_id}:{receiver_id}", frame)
+
+    def on_event(self, channel: str, frame: Frame):
+        kind, _, pair = channel.partition(":")
+        if kind != "dm":
+            return
+        sender_id, receiver_id = (int(part) for part in pair.split(":"))
+        # Receiver's sockets open on this sender, then the sender's own
+        # sockets open on this receiver (e.g., for delivery status)
+        self.deliver(self.registry.pair(receiver_id, sender_id), frame)
+        self.deliver(self.registry.pair(sender_id, receiver_id), frame)
@@ -0,0 +1,83 @@
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.models import ConversationSummary, MessageStatus
+
+PREVIEW_LENGTH = 200
+
+LAST_MESSAGE_COLUMNS = (
+    "last_message_id",
+    "last_sent_at",
+    "last_content",
+    "last_file_url",
+    "last_file_type",
+)
+
+_DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def dialect_insert(dialect: str, model):
+    """An INSERT that supports ON CONFLICT for the database in use."""
+    return _DIALECT_INSERTS[dialect](model)
+
+
+def summary_updates(rows: list[dict], stored: list) -> list[dict]:
+    """Fold a batch of new messages into one summary change per conversation.
+
+    A DM moves the conversation to the top for both people and counts as
+    unread for the receiver; a room message updates the sender's entry for
+    that room.
+    """
+    updates = {}
+    for row, (message_id, sent_at) in zip(rows, stored, strict=True):
+        sender_id = row["sender_id"]
+        if row["room_id"] is not None:
+            targets = [((sender_id, "group", row["room_id"]), 0)]
+        else:
+            receiver_id = row["receiver_id"]
+            targets = [((sender_id, "personal", receiver_id), 0)]
+            if receiver_id != sender_id:
+                unread = 0 if row["status"] == MessageStatus.read else 1
+                targets.append(((receiver_id, "personal", sender_id), unread))
+
+        for (user_id, kind, target_id), unread in targets:
+            entry = updates.get((user_id, kind, target_id))
+            if entry is None:
+                entry = updates[(user_id, kind, target_id)] = {
+                    "user_id": user_id,
+                    "kind": kind,
+                    "target_id": target_id,
+                    "last_message_id": 0,
+                    "unread_count": 0,
+                }
+            if message_id > entry["last_message_id"]:
+                entry.update(
+                    last_message_id=message_id,
+                    last_sent_at=sent_at,
+                    last_content=(row["content"] or "")[:PREVIEW_LENGTH],
+                    last_file_url=row["file_url"],
+                    last_file_type=row["file_type"],
+                )
+            entry["unread_count"] += unread
+
+    # A fixed order keeps concurrent writers from deadlocking on these rows
+    return [updates[key] for key in sorted(updates)]
+
+
+def upsert_summaries(dialect: str, updates: list[dict]):
+    """INSERT ... ON CONFLICT DO UPDATE for the rows from ``summary_updates``.
+
+    The last message only moves forward, so batches committed out of order
+    by different workers still leave the newest one in place.
+    """
+    stmt = dialect_insert(dialect, ConversationSummary).values(updates)
+    table = ConversationSummary.__table__
+    newer = stmt.excluded.last_message_id > table.c.last_message_id
+    values = {
+        column: case((newer, stmt.excluded[column]), else_=table.c[column])
+        for column in LAST_MESSAGE_COLUMNS
+    }
+    values["unread_count"] = table.c.unread_count + stmt.excluded.unread_count
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "kind", "target_id"], set_=values
+    )
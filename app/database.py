@@ -1,7 +1,8 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-from app.config import DATABASE_URL
+from app.config import ASYNC_DATABASE_URL, DATABASE_URL
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -13,3 +14,25 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+")[0]
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+# Used by the WebSocket handlers so database round-trips never block the loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL or to_async_url(DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
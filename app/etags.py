@@ -0,0 +1,21 @@
+import hashlib
+import json
+
+from fastapi import Request
+
+
+def etag_for(payload) -> str:
+    """Strong ETag for a JSON-serializable payload."""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return f'"{hashlib.sha256(raw.encode()).hexdigest()[:32]}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match calls for
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags
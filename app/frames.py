@@ -0,0 +1,19 @@
+import json
+
+
+class Frame:
+    """A WebSocket payload encoded once and shared by every recipient."""
+
+    __slots__ = ("text", "bytes")
+
+    def __init__(self, text: str, data: bytes | None = None):
+        self.text = text
+        self.bytes = data if data is not None else text.encode()
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "Frame":
+        return cls(json.dumps(payload))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Frame":
+        return cls(data.decode(), data)
@@ -1,16 +1,48 @@
-import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
+from app.backplane import backplane
 from app.database import engine
-from app.routes import auth, chats, communication, home, profile, search, user_to_user
+from app.message_writer import message_writer
+from app.password_pool import password_pool
+from app.presence import presence
+from app.routes import (
+    auth,
+    chats,
+    communication,
+    home,
+    metrics,
+    profile,
+    search,
+    user_to_user,
+)
+from app.static import AttachmentFiles
+from app.thumbnails import thumbnail_pipeline
 from database.models import Base
 
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await backplane.start()
+    presence.start()
+    message_writer.start()
+    password_pool.start()
+    thumbnail_pipeline.start()
+    try:
+        yield
+    finally:
+        await thumbnail_pipeline.stop()
+        password_pool.stop()
+        await message_writer.stop()
+        await presence.stop()
+        await backplane.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://127.0.0.1:8000",
     "http://localhost:8000",
@@ -25,6 +57,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all HTTP methods (GET, POST, etc.)
     allow_headers=["*"],  # Allows all headers
+    # Paginated lists name their next page in this header
+    expose_headers=["X-Next-Cursor"],
 )
 app.include_router(chats.router)
 app.include_router(communication.router)
@@ -32,29 +66,15 @@ app.include_router(auth.router)
 app.include_router(profile.router)
 app.include_router(search.router)
 app.include_router(user_to_user.router)
+app.include_router(metrics.router)
 
 app.mount(
     "/profile_images",
-    StaticFiles(directory=profile.UPLOAD_PROFILE_DIR),  # app/uploads/profile_pics/
+    AttachmentFiles(directory=profile.UPLOAD_PROFILE_DIR),  # app/uploads/profile_pics/
     name="profile_images",
 )
 
-app.mount(
-    "/uploads/messages",  # URL path where files can be accessed
-    StaticFiles(
-        directory=os.path.join("uploads", "messages")
-    ),  # Correct path to the 'uploads/messages' directory
-    name="message_files",
-)
-
-app.mount(
-    "/uploads/group-image",  # URL path where files can be accessed
-    StaticFiles(
-        directory=os.path.join("uploads", "group-image")
-    ),  # Correct path to the 'uploads/messages' directory
-    name="group-images",
-)
-
 app.include_router(home.router)
 app.include_router(user_to_user.router)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Serves every upload directory (messages, group-image, profile_pics, thumbnails)
+app.mount("/uploads", AttachmentFiles(directory="uploads"), name="uploads")
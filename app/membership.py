@@ -0,0 +1,109 @@
+import json
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.backplane import Backplane, backplane
+from app.cache import TTLCache
+from app.config import MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL
+from app.frames import Frame
+from database.models import RoomMembers
+
+MEMBERSHIP_CHANNEL = "membership"
+
+
+class MembershipCache:
+    """Per-room member sets (user id -> is_admin).
+
+    A room is loaded with one query the first time it is checked. The routes
+    that change membership then update the loaded set in place, so
+    authorization checks are set lookups, and announce the change over the
+    backplane so every other worker applies it too. The TTL only bounds how
+    long a lost announcement can go unseen.
+
+    Every change bumps the room's generation, and a load only stores its
+    result if no change arrived while it was reading, since its rows may
+    predate that change.
+    """
+
+    def __init__(
+        self,
+        backplane: Backplane,
+        maxsize: int = MEMBERSHIP_CACHE_SIZE,
+        ttl: float = MEMBERSHIP_CACHE_TTL,
+    ):
+        self._rooms = TTLCache("membership", maxsize=maxsize, ttl=ttl)
+        self._generations: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.backplane = backplane
+        backplane.subscribe(self.on_event)
+
+    @staticmethod
+    def _statement(roomid: int):
+        return select(RoomMembers.user_id, RoomMembers.is_admin).where(
+            RoomMembers.room_id == roomid
+        )
+
+    def _store(self, roomid: int, generation: int, rows) -> dict[int, bool]:
+        members = {user_id: bool(is_admin) for user_id, is_admin in rows}
+        with self._lock:
+            if self._generations.get(roomid, 0) == generation:
+                self._rooms.set(roomid, members)
+        return members
+
+    def members(self, roomid: int, db: Session) -> dict[int, bool]:
+        members = self._rooms.get(roomid)
+        if members is None:
+            generation = self._generations.get(roomid, 0)
+            rows = db.execute(self._statement(roomid)).all()
+            members = self._store(roomid, generation, rows)
+        return members
+
+    async def members_async(self, roomid: int, db: AsyncSession) -> dict[int, bool]:
+        members = self._rooms.get(roomid)
+        if members is None:
+            generation = self._generations.get(roomid, 0)
+            rows = (await db.execute(self._statement(roomid))).all()
+            members = self._store(roomid, generation, rows)
+        return members
+
+    def prime(self, roomid: int, members: dict[int, bool]):
+        self._rooms.set(roomid, members)
+
+    def add(self, roomid: int, user_id: int, is_admin: bool = False):
+        # Rooms that are not loaded yet will read the new row on first use
+        with self._lock:
+            self._generations[roomid] = self._generations.get(roomid, 0) + 1
+            members = self._rooms.peek(roomid)
+            if members is not None:
+                members[user_id] = is_admin
+
+    def remove(self, roomid: int, user_id: int):
+        with self._lock:
+            self._generations[roomid] = self._generations.get(roomid, 0) + 1
+            members = self._rooms.peek(roomid)
+            if members is not None:
+                members.pop(user_id, None)
+
+    async def announce(self, roomid: int, user_id: int, is_admin: bool | None):
+        """Tell every worker about a committed change; ``None`` means removed."""
+        await self.backplane.publish(
+            MEMBERSHIP_CHANNEL,
+            Frame.from_payload(
+                {"room_id": roomid, "user_id": user_id, "is_admin": is_admin}
+            ),
+        )
+
+    def on_event(self, channel: str, frame: Frame):
+        if channel != MEMBERSHIP_CHANNEL:
+            return
+        change = json.loads(frame.text)
+        if change["is_admin"] is None:
+            self.remove(change["room_id"], change["user_id"])
+        else:
+            self.add(change["room_id"], change["user_id"], change["is_admin"])
+
+
+membership = MembershipCache(backplane)
@@ -0,0 +1,157 @@
+import html
+
+from sqlalchemy import (
+    Float,
+    and_,
+    cast,
+    column,
+    func,
+    literal_column,
+    or_,
+    select,
+    table,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import REGCONFIG
+
+from app.pagination import decode_rank_cursor, encode_rank_cursor
+from database.models import SEARCH_CONFIG, Message, RoomMembers, User
+
+# Snippets are built with control characters as match markers, escaped,
+# and only then given <mark> tags, so message text never reaches the
+# client as markup.
+_START, _STOP = "\x02", "\x03"
+HEADLINE_OPTIONS = f"StartSel={_START}, StopSel={_STOP}, MaxWords=24, MinWords=8, MaxFragments=2"
+SNIPPET_TOKENS = 16
+
+# The FTS5 table SQLite databases get in place of search_vector
+messages_fts = table("messages_fts", column("rowid"))
+
+
+def _visible_to(user_id: int):
+    # Rooms the user belongs to, and DMs they sent or received
+    return or_(
+        Message.room_id.in_(
+            select(RoomMembers.room_id).where(RoomMembers.user_id == user_id)
+        ),
+        and_(
+            Message.receiver_id.isnot(None),
+            or_(Message.sender_id == user_id, Message.receiver_id == user_id),
+        ),
+    )
+
+
+def _scope(user_id: int, room_id: int | None, peer_id: int | None) -> list:
+    conditions = [_visible_to(user_id)]
+    if room_id is not None:
+        conditions.append(Message.room_id == room_id)
+    if peer_id is not None:
+        conditions.append(
+            or_(
+                and_(Message.sender_id == user_id, Message.receiver_id == peer_id),
+                and_(Message.sender_id == peer_id, Message.receiver_id == user_id),
+            )
+        )
+    return conditions
+
+
+def _postgresql_statement(query: str, conditions: list, cursor, limit: int):
+    config = cast(SEARCH_CONFIG, REGCONFIG)
+    tsquery = func.websearch_to_tsquery(config, query)
+    rank = cast(func.ts_rank_cd(Message.search_vector, tsquery), Float)
+
+    # Rank and page on the GIN index matches alone; headlines are costly, so
+    # they are only built for the rows of the page.
+    matches = select(Message.id, rank.label("rank")).where(
+        Message.search_vector.op("@@")(tsquery), *conditions
+    )
+    if cursor:
+        matches = matches.where(tuple_(rank, Message.id) < tuple_(*cursor))
+    page = (
+        matches.order_by(rank.desc(), Message.id.desc()).limit(limit + 1).subquery()
+    )
+    return (
+        select(
+            Message,
+            User.first_name,
+            User.last_name,
+            page.c.rank,
+            func.ts_headline(config, Message.content, tsquery, HEADLINE_OPTIONS),
+        )
+        .join(page, page.c.id == Message.id)
+        .join(User, User.id == Message.sender_id)
+        .order_by(page.c.rank.desc(), Message.id.desc())
+    )
+
+
+def _fts5_query(query: str) -> str:
+    # Every word as a quoted FTS5 string, so user input is never parsed as
+    # query syntax
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+
+def _sqlite_statement(query: str, conditions: list, cursor, limit: int):
+    # The table name itself stands for the row's match in FTS5 functions
+    fts = literal_column("messages_fts")
+    # bm25() is lower for better matches
+    rank = -func.bm25(fts)
+    stmt = (
+        select(
+            Message,
+            User.first_name,
+            User.last_name,
+            rank.label("rank"),
+            func.snippet(fts, 0, _START, _STOP, "…", SNIPPET_TOKENS),
+        )
+        .select_from(Message)
+        .join(messages_fts, messages_fts.c.rowid == Message.id)
+        .join(User, User.id == Message.sender_id)
+        .where(fts.op("MATCH")(_fts5_query(query)), *conditions)
+    )
+    if cursor:
+        stmt = stmt.where(tuple_(rank, Message.id) < tuple_(*cursor))
+    return stmt.order_by(rank.desc(), Message.id.desc()).limit(limit + 1)
+
+
+def search_statement(
+    dialect: str,
+    user_id: int,
+    query: str,
+    room_id: int | None = None,
+    peer_id: int | None = None,
+    cursor: str | None = None,
+    limit: int = 20,
+):
+    keyset = decode_rank_cursor(cursor) if cursor else None
+    conditions = _scope(user_id, room_id, peer_id)
+    if dialect == "sqlite":
+        return _sqlite_statement(query, conditions, keyset, limit)
+    return _postgresql_statement(query, conditions, keyset, limit)
+
+
+def highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def search_page(rows: list, limit: int) -> tuple[list[dict], str | None]:
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results = [
+        {
+            "message_id": message.id,
+            "room_id": message.room_id,
+            "sender_id": message.sender_id,
+            "receiver_id": message.receiver_id,
+            "sender": f"{first_name} {last_name}",
+            "snippet": highlight(snippet or ""),
+            "file_url": message.file_url,
+            "timestamp": message.sent_at,
+            "rank": rank,
+        }
+        for message, first_name, last_name, rank, snippet in rows
+    ]
+    next_cursor = None
+    if has_more:
+        last = results[-1]
+        next_cursor = encode_rank_cursor(last["rank"], last["message_id"])
+    return results, next_cursor
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy import insert
+
+from app.config import MESSAGE_BATCH_SIZE, MESSAGE_FLUSH_MS
+from app.conversations import summary_updates, upsert_summaries
+from app.database import AsyncSessionLocal
+from app.metrics import metrics
+from app.watermarks import record_room_messages, reserve_room_positions
+from database.models import Message, MessageStatus
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_COLUMNS = (
+    "content",
+    "sender_id",
+    "room_id",
+    "receiver_id",
+    "file_url",
+    "file_type",
+    "status",
+)
+
+# Queued by stop(): everything ahead of it is written, then the writer exits
+_STOP = object()
+
+
+class MessageWriter:
+    """Buffers chat messages for a few milliseconds and persists each batch
+    with a single multi-row INSERT ... RETURNING in one transaction, along
+    with the room positions, conversation summaries and room counters the
+    batch touches.
+    """
+
+    def __init__(
+        self,
+        flush_ms: float = MESSAGE_FLUSH_MS,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        session_factory=AsyncSessionLocal,
+    ):
+        self.flush_seconds = flush_ms / 1000
+        self.batch_size = batch_size
+        self.session_factory = session_factory
+        self.queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Cancelling could interrupt a batch mid-write and leave its callers
+        # waiting forever; the writer finishes the queue and returns instead.
+        self.queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+        # Messages submitted while the writer was draining
+        pending = []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        if pending:
+            await self._flush(pending)
+
+    async def submit(self, **values) -> dict:
+        """Queue one message; resolves to its ``id`` and ``sent_at`` once committed."""
+        self.start()
+        row = {column: values.get(column) for column in MESSAGE_COLUMNS}
+        if row["status"] is None:
+            row["status"] = MessageStatus.sent
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((row, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _write(self, rows: list[dict]) -> list:
+        async with self.session_factory() as db:
+            positions = await reserve_room_positions(db, rows)
+            result = await db.execute(
+                insert(Message).returning(
+                    Message.id, Message.sent_at, sort_by_parameter_order=True
+                ),
+                [
+                    {**row, "room_seq": position}
+                    for row, position in zip(rows, positions, strict=True)
+                ],
+            )
+            stored = result.all()
+            await db.execute(
+                upsert_summaries(db.bind.dialect.name, summary_updates(rows, stored))
+            )
+            await record_room_messages(db, rows, stored, positions)
+            await db.commit()
+        return stored
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+        try:
+            stored = await self._write([row for row, _ in batch])
+        except Exception as exc:
+            if len(batch) > 1:
+                # One bad row fails the whole INSERT; write the rows one by
+                # one so only its own caller gets the error.
+                logger.warning("Batch of %d chat messages failed, retrying singly", len(batch))
+                metrics.incr("messages.batch_retries")
+                for item in batch:
+                    await self._flush([item])
+                return
+            logger.exception("Failed to persist a chat message")
+            metrics.incr("messages.write_errors")
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(exc)
+            return
+
+        metrics.observe("messages.batch_size", len(batch))
+        metrics.observe("messages.commit_latency_ms", (time.perf_counter() - started) * 1000)
+        for (_, future), (message_id, sent_at) in zip(batch, stored, strict=True):
+            if not future.done():
+                future.set_result({"id": message_id, "sent_at": sent_at})
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,46 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """In-process counters, gauges and timings exposed on /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = defaultdict(int)
+        self._gauges: dict[str, float] = {}
+        self._observations: dict[str, dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            stats = self._observations.get(name)
+            if stats is None:
+                stats = self._observations[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["max"] = max(stats["max"], value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "observations": {
+                    name: {
+                        **stats,
+                        "avg": stats["sum"] / stats["count"] if stats["count"] else 0.0,
+                    }
+                    for name, stats in self._observations.items()
+                },
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+
+def encode_cursor(sent_at: datetime, message_id: int) -> str:
+    raw = json.dumps([sent_at.isoformat(), message_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sent_at, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(sent_at), int(message_id)
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+
+def encode_id_cursor(message_id: int) -> str:
+    raw = json.dumps([message_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_id_cursor(cursor: str) -> int:
+    # Older cursors carried [sent_at, id]; the id alone orders the history
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        *_, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return int(message_id)
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+
+def encode_rank_cursor(rank: float, message_id: int) -> str:
+    raw = json.dumps([rank, message_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(rank), int(message_id)
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
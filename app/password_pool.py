@@ -0,0 +1,139 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from app.config import (
+    PASSWORD_POOL_MAX_PENDING,
+    PASSWORD_POOL_TIMEOUT,
+    PASSWORD_POOL_WORKERS,
+)
+from app.metrics import metrics
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# Module-level so worker processes can unpickle them
+def bcrypt_hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def bcrypt_verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordPool:
+    """Runs bcrypt in a bounded pool of worker processes.
+
+    At most ``max_pending`` jobs may be queued or running; beyond that, and
+    for jobs that take longer than ``timeout`` seconds, callers get a 503
+    instead of piling up behind a login storm.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_POOL_WORKERS,
+        max_pending: int = PASSWORD_POOL_MAX_PENDING,
+        timeout: float = PASSWORD_POOL_TIMEOUT,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that already runs threads and an
+                # event loop is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+        return self._executor
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise self._busy("passwords.rejected")
+            self._pending += 1
+            metrics.set_gauge("passwords.queue_depth", self._pending)
+
+    def _release(self, started: float):
+        with self._lock:
+            self._pending -= 1
+            metrics.set_gauge("passwords.queue_depth", self._pending)
+        metrics.observe("passwords.latency_ms", (time.perf_counter() - started) * 1000)
+
+    def _replace(self, broken: ProcessPoolExecutor):
+        # A worker died (crash, OOM kill) and took the whole pool with it
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        metrics.incr("passwords.pool_restarts")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    @staticmethod
+    def _busy(counter: str) -> HTTPException:
+        metrics.incr(counter)
+        return HTTPException(
+            status_code=503,
+            detail="Server is busy, please try again",
+            headers={"Retry-After": "1"},
+        )
+
+    def _submit(self, fn, *args) -> tuple[ProcessPoolExecutor, Future]:
+        executor = self.start()
+        self._acquire()
+        started = time.perf_counter()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool as exc:
+            self._release(started)
+            self._replace(executor)
+            raise self._busy("passwords.pool_broken") from exc
+        # The slot is held until the job has really finished: one that timed
+        # out after it started keeps its worker busy all the same.
+        future.add_done_callback(lambda _: self._release(started))
+        return executor, future
+
+    async def run(self, fn, *args):
+        executor, future = self._submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except TimeoutError as exc:
+            future.cancel()
+            raise self._busy("passwords.timeouts") from exc
+        except BrokenProcessPool as exc:
+            self._replace(executor)
+            raise self._busy("passwords.pool_broken") from exc
+
+    def run_sync(self, fn, *args):
+        # For sync routes, which already run on the threadpool
+        executor, future = self._submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError as exc:
+            future.cancel()
+            raise self._busy("passwords.timeouts") from exc
+        except BrokenProcessPool as exc:
+            self._replace(executor)
+            raise self._busy("passwords.pool_broken") from exc
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,160 @@
+import asyncio
+import contextlib
+import json
+import logging
+import time
+import uuid
+
+from app.backplane import Backplane, backplane
+from app.config import PRESENCE_HEARTBEAT_SECONDS
+from app.frames import Frame
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_CHANNEL = "presence"
+# Heartbeats a worker may miss before its users are taken offline
+MISSED_HEARTBEATS = 3
+
+
+class RoomPresence:
+    """Distinct users with a socket open on each room, across every worker.
+
+    A worker counts its own sockets per (room, user) and only announces a
+    user's first socket on a room opening and their last one closing. Every
+    worker folds the announcements into per-room sets keyed by the worker
+    they came from, so a user connected through two workers counts once.
+    Each worker also re-announces everything it holds on a heartbeat: one
+    that starts late catches up, and the users of one that stops being heard
+    from go offline.
+    """
+
+    def __init__(
+        self, backplane: Backplane, heartbeat: float = PRESENCE_HEARTBEAT_SECONDS
+    ):
+        self.backplane = backplane
+        self.heartbeat = heartbeat
+        self.worker_id = uuid.uuid4().hex
+        self._sockets: dict[tuple[int, int], int] = {}
+        # room -> user -> workers the user is online through
+        self._online: dict[int, dict[int, set[str]]] = {}
+        # worker -> its (room, user) entries; remote workers -> last heard from
+        self._entries: dict[str, set[tuple[int, int]]] = {}
+        self._heard: dict[str, float] = {}
+        # One sender keeps a worker's announcements in order
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        backplane.subscribe(self.on_event)
+
+    def online(self, roomid: int) -> int:
+        return len(self._online.get(roomid, ()))
+
+    def join(self, roomid: int, user_id: int):
+        key = (roomid, user_id)
+        self._sockets[key] = self._sockets.get(key, 0) + 1
+        if self._sockets[key] == 1:
+            self._set(self.worker_id, roomid, user_id, True)
+            self._queue.put_nowait(
+                {"room_id": roomid, "user_id": user_id, "online": True}
+            )
+
+    def leave(self, roomid: int, user_id: int):
+        key = (roomid, user_id)
+        remaining = self._sockets.get(key, 0) - 1
+        if remaining > 0:
+            self._sockets[key] = remaining
+        elif self._sockets.pop(key, None) is not None:
+            self._set(self.worker_id, roomid, user_id, False)
+            self._queue.put_nowait(
+                {"room_id": roomid, "user_id": user_id, "online": False}
+            )
+
+    def start(self):
+        if self._task is None or self._task.done():
+            # The first heartbeat goes out straight away and covers anything
+            # queued before the sender ran
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        # An empty snapshot takes this worker's users offline everywhere
+        await self._publish({"rooms": []})
+
+    async def _run(self):
+        next_beat = time.monotonic()
+        while True:
+            wait = next_beat - time.monotonic()
+            if wait <= 0:
+                self._expire()
+                await self._publish({"rooms": [list(key) for key in self._sockets]})
+                next_beat = time.monotonic() + self.heartbeat
+                continue
+            try:
+                change = await asyncio.wait_for(self._queue.get(), wait)
+            except TimeoutError:
+                continue
+            await self._publish(change)
+
+    async def _publish(self, payload: dict):
+        try:
+            await self.backplane.publish(
+                PRESENCE_CHANNEL,
+                Frame.from_payload({"worker": self.worker_id, **payload}),
+            )
+        except Exception:
+            # The next heartbeat carries the same state
+            logger.exception("Could not announce presence")
+
+    def on_event(self, channel: str, frame: Frame):
+        if channel != PRESENCE_CHANNEL:
+            return
+        change = json.loads(frame.text)
+        worker = change["worker"]
+        if worker == self.worker_id:
+            return
+        self._heard[worker] = time.monotonic()
+        if "rooms" in change:
+            self._replace(
+                worker, {(roomid, user_id) for roomid, user_id in change["rooms"]}
+            )
+        else:
+            self._set(worker, change["room_id"], change["user_id"], change["online"])
+
+    def _set(self, worker: str, roomid: int, user_id: int, online: bool):
+        entries = self._entries.setdefault(worker, set())
+        users = self._online.setdefault(roomid, {})
+        if online:
+            entries.add((roomid, user_id))
+            users.setdefault(user_id, set()).add(worker)
+            return
+        entries.discard((roomid, user_id))
+        workers = users.get(user_id, set())
+        workers.discard(worker)
+        if not workers:
+            users.pop(user_id, None)
+        if not users:
+            self._online.pop(roomid, None)
+
+    def _replace(self, worker: str, entries: set[tuple[int, int]]):
+        current = self._entries.get(worker, set())
+        for roomid, user_id in current - entries:
+            self._set(worker, roomid, user_id, False)
+        for roomid, user_id in entries - current:
+            self._set(worker, roomid, user_id, True)
+        if not entries:
+            self._entries.pop(worker, None)
+            self._heard.pop(worker, None)
+
+    def _expire(self):
+        cutoff = time.monotonic() - MISSED_HEARTBEATS * self.heartbeat
+        for worker, heard in list(self._heard.items()):
+            if heard < cutoff:
+                self._replace(worker, set())
+
+
+presence = RoomPresence(backplane)
@@ -1,16 +1,39 @@
+import json
 import os
-import uuid
 from datetime import UTC, datetime, timedelta
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from app.config import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY
-from app.database import get_db
+from app.attachments import release_attachment
+from app.autocomplete import autocomplete
+from app.config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    SECRET_KEY,
+    USERS_MAX_PAGE_SIZE,
+    USERS_PAGE_SIZE,
+    USERS_STREAM_BATCH,
+)
+from app.database import SessionLocal, get_db
 from app.schemas import UserLogin, UserResponse
-from app.utils import hash_password, verify_password
+from app.thumbnails import thumbnail_pipeline
+from app.uploads import save_upload_file
+from app.utils import get_current_user, hash_password_async, verify_password
 from database.models import User
 
 router = APIRouter()
@@ -44,24 +67,32 @@ async def register(
 
     profile_image_filename = None
     if profile_image:
-        ext = profile_image.filename.split(".")[-1]
-        profile_image_filename = f"profile_{uuid.uuid4()}.{ext}"
-        file_path = os.path.join(UPLOAD_DIR, profile_image_filename)
-        with open(file_path, "wb") as f:
-            f.write(await profile_image.read())
-    hashed_pw = hash_password(password)
-    db_user = User(
-        username=username,
-        first_name=first_name,
-        middle_name=middle_name,
-        last_name=last_name,
-        email=email,
-        password=hashed_pw,
-        profile_image=profile_image_filename,
-    )
-    db.add(db_user)
-    db.commit()
+        profile_image_filename = await save_upload_file(profile_image, UPLOAD_DIR)
+    try:
+        hashed_pw = await hash_password_async(password)
+        db_user = User(
+            username=username,
+            first_name=first_name,
+            middle_name=middle_name,
+            last_name=last_name,
+            email=email,
+            password=hashed_pw,
+            profile_image=profile_image_filename,
+        )
+        db.add(db_user)
+        db.commit()
+    except Exception:
+        # The upload already holds a reference to its blob; no user owns it now
+        db.rollback()
+        if profile_image_filename:
+            await release_attachment(UPLOAD_DIR, profile_image_filename)
+        raise
     db.refresh(db_user)
+    if profile_image_filename:
+        thumbnail_pipeline.submit(
+            f"/{UPLOAD_DIR}/{profile_image_filename}", profile_image.content_type
+        )
+    autocomplete.add_user(db_user)
     return db_user
 
 
@@ -80,7 +111,43 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     # return {"access_token": access_token, "token_type": "bearer"}
 
 
+USER_FIELDS = (User.id, User.username, User.email)
+
+
+def stream_users(after: int | None):
+    # Own session: the request's is closed before the body is done streaming.
+    # yield_per fetches from a server-side cursor, so memory stays flat
+    # however many users there are.
+    stmt = select(*USER_FIELDS).order_by(User.id)
+    if after is not None:
+        stmt = stmt.where(User.id > after)
+    with SessionLocal() as db:
+        result = db.execute(stmt.execution_options(yield_per=USERS_STREAM_BATCH))
+        for rows in result.partitions():
+            yield "".join(json.dumps(row._asdict()) + "\n" for row in rows)
+
+
 @router.get("/users", response_model=list[UserResponse])
-def get_all_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    return users
+def get_all_users(
+    response: Response,
+    after: int | None = None,
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    authorization: str | None = Header(None),
+    db: Session = Depends(get_db),
+):
+    # ndjson streams the whole directory (from `after` on) one user per line,
+    # so it is only for signed-in users
+    if format == "ndjson":
+        get_current_user(authorization, db)
+        return StreamingResponse(stream_users(after), media_type="application/x-ndjson")
+
+    stmt = select(*USER_FIELDS).order_by(User.id).limit(limit + 1)
+    if after is not None:
+        stmt = stmt.where(User.id > after)
+    rows = db.execute(stmt).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        # The body stays a plain list; the next page is named in a header
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return [row._asdict() for row in rows]
@@ -1,17 +1,40 @@
 import os
-from uuid import uuid4
-
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from functools import partial
+
+from anyio import from_thread
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from sqlalchemy import and_, select, update
 from sqlalchemy.orm import Session
 
-from app.database import get_db
+from app.attachments import release_attachment, thumbnails_of
+from app.autocomplete import autocomplete
+from app.config import ROOMS_MAX_PAGE_SIZE, ROOMS_PAGE_SIZE
+from app.database import AsyncSessionLocal, get_db
+from app.etags import etag_for, not_modified
+from app.membership import membership
+from app.presence import presence
 from app.schemas import JoinRoom
+from app.thumbnails import small_thumbnail, thumbnail_pipeline
+from app.uploads import save_upload_file
 from app.utils import (
     check_user_inroom,
+    check_user_is_admin,
+    create_room_ticket,
     get_current_user,
-    hash_password,
+    hash_password_async,
     verify_password,
 )
+from app.watermarks import forget_room_watermark, mark_room_read
 from database.models import Chatroom, RoomMembers, User
 
 router = APIRouter()
@@ -20,6 +43,17 @@ UPLOAD_FOLDER = os.path.join("uploads", "group-image")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
+async def room_image_ready(roomid: int, _thumbnails: dict):
+    # The room's listing entry now has a thumbnail
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Chatroom)
+            .where(Chatroom.id == roomid)
+            .values(version=Chatroom.version + 1)
+        )
+        await db.commit()
+
+
 @router.post("/creategroup")
 async def create_table(
     room_name: str = Form(...),
@@ -30,25 +64,20 @@ async def create_table(
 ):
     is_private = bool(password)
 
-    hashed_password = hash_password(password) if is_private else None
+    hashed_password = await hash_password_async(password) if is_private else None
 
     filename = None
     if image:
-        ext = os.path.splitext(image.filename)[1]
-        filename = f"{uuid4().hex}{ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        with open(file_path, "wb") as f:
-            f.write(await image.read())
+        filename = await save_upload_file(image, UPLOAD_FOLDER)
 
     # Step 1: Create chatroom
     new_room = Chatroom(
-
         roomname=room_name,
         is_private=is_private,
         created_by=user.id,
         password=hashed_password,
         image=filename,
-
+        member_count=1,
     )
     db.add(new_room)
     db.commit()
@@ -58,22 +87,107 @@ async def create_table(
     room_member = RoomMembers(user_id=user.id, room_id=new_room.id, is_admin=True)
     db.add(room_member)
     db.commit()
+    if filename:
+        thumbnail_pipeline.submit(
+            f"/{UPLOAD_FOLDER}/{filename}",
+            image.content_type,
+            on_ready=partial(room_image_ready, new_room.id),
+        )
+    membership.prime(new_room.id, {user.id: True})
+    await membership.announce(new_room.id, user.id, True)
+    autocomplete.add_room(new_room)
 
     return {"message": "Chatroom created successfully", "room_id": new_room.id}
 
 
-@router.get("/getgroups")
-def get_room(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    chat_rooms = db.query(Chatroom).all()
-    
-    room_list = [{
-        "id": room.id,
-        "name": room.roomname,
-        "image_url": room.image
-    } for room in chat_rooms]
+def room_listing_statement(
+    user_id: int,
+    columns: tuple,
+    mine: bool,
+    public_only: bool,
+    after: int | None,
+    limit: int,
+):
+    stmt = (
+        select(*columns)
+        .outerjoin(
+            RoomMembers,
+            and_(RoomMembers.room_id == Chatroom.id, RoomMembers.user_id == user_id),
+        )
+        .order_by(Chatroom.id)
+        .limit(limit + 1)
+    )
+    if mine:
+        stmt = stmt.where(RoomMembers.id.isnot(None))
+    if public_only:
+        stmt = stmt.where(Chatroom.is_private.is_(False))
+    if after is not None:
+        stmt = stmt.where(Chatroom.id > after)
+    return stmt
 
-    return {"rooms": room_list}
 
+@router.get("/getgroups")
+def get_room(
+    request: Request,
+    response: Response,
+    mine: bool = False,
+    public_only: bool = False,
+    after: int | None = None,
+    limit: int = Query(ROOMS_PAGE_SIZE, ge=1, le=ROOMS_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    page = (mine, public_only, after, limit)
+    # A page only changes when one of its rooms does (every edit, join and
+    # leave moves that room's version on), when rooms enter it, or when who
+    # is online changes. The ETag covers just those, so a poller that holds
+    # the page gets a 304 before names, images or thumbnails are read.
+    versions = db.execute(
+        room_listing_statement(user.id, (Chatroom.id, Chatroom.version), *page)
+    ).all()
+    etag = etag_for(
+        [
+            user.id,
+            *page,
+            [
+                (room.id, room.version, presence.online(room.id))
+                for room in versions[:limit]
+            ],
+            len(versions) > limit,
+        ]
+    )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    columns = (
+        Chatroom.id,
+        Chatroom.roomname,
+        Chatroom.image,
+        thumbnails_of(UPLOAD_FOLDER, Chatroom.image).label("image_thumbnails"),
+        Chatroom.is_private,
+        Chatroom.member_count,
+        RoomMembers.id.isnot(None).label("is_member"),
+    )
+    rows = db.execute(room_listing_statement(user.id, columns, *page)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    room_list = [
+        {
+            "id": room.id,
+            "name": room.roomname,
+            "image_url": room.image,
+            "image_thumbnail_url": small_thumbnail(room.image_thumbnails),
+            "is_private": room.is_private,
+            "is_member": bool(room.is_member),
+            "member_count": room.member_count,
+            "online_count": presence.online(room.id),
+        }
+        for room in rows
+    ]
+    response.headers.update(headers)
+    return {"rooms": room_list, "next_cursor": rows[-1].id if has_more else None}
 
 
 @router.post("/joingroup")
@@ -99,8 +213,21 @@ def join_room(
 
     new_member = RoomMembers(user_id=user.id, room_id=members.room_id, is_admin=False)
     db.add(new_member)
+    db.query(Chatroom).filter(Chatroom.id == members.room_id).update(
+        {
+            Chatroom.member_count: Chatroom.member_count + 1,
+            Chatroom.version: Chatroom.version + 1,
+        }
+    )
     db.commit()
-    return {"message": f"Joined chat room '{room.roomname}' successfully"}
+    membership.add(members.room_id, user.id, is_admin=False)
+    from_thread.run(membership.announce, members.room_id, user.id, False)
+    # Earlier messages do not count as unread for a new member
+    mark_room_read(db, user.id, members.room_id)
+    response = {"message": f"Joined chat room '{room.roomname}' successfully"}
+    if room.is_private:
+        response["room_ticket"] = create_room_ticket(user.id, room)
+    return response
 
 
 @router.put("/group/{room_id}/edit-info")
@@ -116,12 +243,7 @@ async def update_group_info(
         raise HTTPException(status_code=404, detail="Chatroom not found")
 
     # Check admin rights
-    member = (
-        db.query(RoomMembers)
-        .filter(RoomMembers.room_id == room_id, RoomMembers.user_id == user.id)
-        .first()
-    )
-    if not member or not member.is_admin:
+    if not check_user_is_admin(user.id, room_id, db):
         raise HTTPException(
             status_code=403, detail="Only admins can update the chatroom"
         )
@@ -133,11 +255,13 @@ async def update_group_info(
 
     if password is not None:
         chatroom.is_private = bool(password)
-        chatroom.password = hash_password(password) if password else None
+        chatroom.password = await hash_password_async(password) if password else None
         updated = True
 
     if updated:
+        chatroom.version = Chatroom.version + 1
         db.commit()
+        autocomplete.add_room(chatroom)
         return {"message": "Room updated successfully"}
     else:
         return {"message": "No changes made"}
@@ -156,63 +280,63 @@ async def update_group_image(
         raise HTTPException(status_code=404, detail="Chatroom not found")
 
     # Check admin rights
-    member = (
-        db.query(RoomMembers)
-        .filter(RoomMembers.room_id == room_id, RoomMembers.user_id == user.id)
-        .first()
-    )
-    if not member or not member.is_admin:
+    if not check_user_is_admin(user.id, room_id, db):
         raise HTTPException(
             status_code=403, detail="Only admins can update the chatroom"
         )
 
+    old_image = chatroom.image
+
     # Remove old image if requested
-    if remove_image and chatroom.image:
-        old_path = os.path.join(UPLOAD_FOLDER, chatroom.image)
-        if os.path.exists(old_path):
-            os.remove(old_path)
+    if remove_image:
         chatroom.image = None
 
     # Upload new image
     if new_image:
         print("Uploading new image:", new_image.filename)
-        ext = os.path.splitext(new_image.filename)[1]
-        filename = f"{uuid4().hex}{ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
         try:
-            with open(file_path, "wb") as f:
-                f.write(await new_image.read())
-        except Exception as e:
+            chatroom.image = await save_upload_file(new_image, UPLOAD_FOLDER)
+            thumbnail_pipeline.submit(
+                f"/{UPLOAD_FOLDER}/{chatroom.image}",
+                new_image.content_type,
+                on_ready=partial(room_image_ready, chatroom.id),
+            )
+        except OSError as e:
             print("Failed to write file:", e)
             raise HTTPException(status_code=500, detail="Image upload failed")
-        # Delete previous image if any
-        if chatroom.image:
-            old_path = os.path.join(UPLOAD_FOLDER, chatroom.image)
-            if os.path.exists(old_path):
-                os.remove(old_path)
-
-        chatroom.image = filename
 
+    chatroom.version = Chatroom.version + 1
     db.commit()
+    # The previous image is shared storage: drop this room's reference to it
+    if old_image and (remove_image or new_image):
+        await release_attachment(UPLOAD_FOLDER, old_image)
     return {"message": "Group image updated successfully"}
 
-    
+
 @router.post("/leftchat/{room_id}")
 def leave_group(
     room_id: int,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    member = (
+    if not check_user_inroom(user.id, room_id, db):
+        raise HTTPException(status_code=404, detail="You are not a member of this room")
+
+    removed = (
         db.query(RoomMembers)
         .filter(RoomMembers.room_id == room_id, RoomMembers.user_id == user.id)
-        .first()
+        .delete()
     )
-
-    if not member:
-        raise HTTPException(status_code=404, detail="You are not a member of this room")
-
-    db.delete(member)
+    if removed:
+        db.query(Chatroom).filter(Chatroom.id == room_id).update(
+            {
+                Chatroom.member_count: Chatroom.member_count - 1,
+                Chatroom.version: Chatroom.version + 1,
+            }
+        )
+    forget_room_watermark(db, user.id, room_id)
     db.commit()
+    membership.remove(room_id, user.id)
+    from_thread.run(membership.announce, room_id, user.id, None)
 
-    return {"message": f"Left chat room {room_id} successfully"}
\ No newline at end of file
+    return {"message": f"Left chat room {room_id} successfully"}
@@ -1,29 +1,61 @@
-import base64
 import json
 import os
-import uuid
 from datetime import datetime
+from functools import partial
 
 from fastapi import (
     APIRouter,
     Depends,
     Header,
     HTTPException,
+    Query,
     WebSocket,
     WebSocketDisconnect,
 )
 from fastapi.responses import HTMLResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.connection_manager import ConnectionManager
-from app.database import SessionLocal, get_db
-from app.utils import check_user_inroom, get_current_user, verify_password, verify_token
+from app.backplane import backplane
+from app.config import (
+    HISTORY_MAX_PAGE_SIZE,
+    HISTORY_PAGE_SIZE,
+    ROOM_TICKET_EXPIRE_MINUTES,
+)
+from app.connection_manager import Connection, ConnectionManager
+from app.database import AsyncSessionLocal, SessionLocal, get_db
+from app.frames import Frame
+from app.membership import membership
+from app.message_writer import message_writer
+from app.pagination import decode_id_cursor, encode_id_cursor
+from app.presence import presence
+from app.schemas import MarkRead
+from app.thumbnails import small_thumbnail, thumbnail_frame, thumbnail_pipeline
+from app.uploads import (
+    UploadError,
+    UploadSlot,
+    receive_message,
+    release_upload,
+    save_base64_upload,
+    upload_error_frame,
+)
+from app.utils import (
+    check_user_inroom,
+    check_user_inroom_async,
+    create_room_ticket,
+    get_current_user,
+    verify_password_async,
+    verify_room_ticket,
+    verify_token,
+    verify_token_async,
+)
+from app.watermarks import forget_room_watermark, mark_room_read, mark_room_read_async
 from database.models import Chatroom, Message, RoomMembers, User
 
 
 def json_text(
-
-    sender: str, message_id: int, text: str, ts: datetime | None = None
+    sender: str, message_id: int | None, text: str, ts: datetime | None = None
 ) -> dict:
     return {
         "type": "text",
@@ -40,6 +72,7 @@ def json_file(
     url: str,
     caption: str = "",
     ts: datetime | None = None,
+    thumbnail_url: str | None = None,
 ) -> dict:
     return {
         "type": "file",
@@ -47,6 +80,7 @@ def json_file(
         "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
         "sender": sender,
         "file_url": url,
+        "thumbnail_url": thumbnail_url,
         "text": caption,
     }
 
@@ -102,6 +136,7 @@ html = """
     </body>
     <script>
         var ws = null;
+        const CHUNK_SIZE = 256 * 1024;
 
         function CreateConnection(event){
             event.preventDefault();
@@ -114,6 +149,7 @@ html = """
             const roomid = document.getElementById("roomid").value;
             const token = document.getElementById("token").value;
             const password = document.getElementById("roompassword").value;
+            const ticket = sessionStorage.getItem(`room_ticket_${roomid}`) || "";
 
             fetch(`http://localhost:8000/chatroom/${roomid}`, {
                 headers: {
@@ -139,12 +175,17 @@ html = """
             });
 
 
-            ws = new WebSocket(`ws://localhost:8000/chat/${roomid}?token=${token}&password=${encodeURIComponent(password)}`);
+            ws = new WebSocket(`ws://localhost:8000/chat/${roomid}?token=${token}&password=${encodeURIComponent(password)}&ticket=${ticket}`);
 
             ws.onmessage = (event) => {
                 const message = document.createElement("li");
                 const text = event.data;
 
+                if (text.startsWith('{"type": "room_ticket"')) {
+                    sessionStorage.setItem(`room_ticket_${roomid}`, JSON.parse(text).ticket);
+                    return;
+                }
+
                 if (text.includes("/uploads/")) {
                     const parts = text.split(" ");
                     const fileUrl = parts.find(p => p.includes("/uploads/"));
@@ -215,21 +256,20 @@ html = """
             const file = fileInput.files[0];
 
             if(file){
-                const reader= new FileReader();
-                reader.onload = () => {
-                    const base64 = reader.result;
-                    const payload = {
-                        type: "file",
-                        filename: file.name,
-                        mimetype: file.type,
-                        data: base64,
-                        text: msg
-                    };
-                    ws.send(JSON.stringify(payload));
-                    document.getElementById("message").value = "";
-                    document.getElementById("fileInput").value = "";
-                };
-                reader.readAsDataURL(file);
+                // Stream the file as binary frames instead of one base64 blob
+                ws.send(JSON.stringify({
+                    type: "upload_begin",
+                    filename: file.name,
+                    mimetype: file.type,
+                    size: file.size,
+                    text: msg
+                }));
+                for (let offset = 0; offset < file.size; offset += CHUNK_SIZE) {
+                    ws.send(file.slice(offset, offset + CHUNK_SIZE));
+                }
+                ws.send(JSON.stringify({ type: "upload_commit" }));
+                document.getElementById("message").value = "";
+                document.getElementById("fileInput").value = "";
             } else{
                 ws.send(JSON.stringify({
                     type: "text",
@@ -252,153 +292,285 @@ def display_home():
     return HTMLResponse(html)
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(backplane, presence)
+
+INVALID_JSON_FRAME = Frame("Invalid JSON format.")
 
 
 @router.websocket("/chat/{roomid}")
-async def websocket_endpoint(
-    websocket: WebSocket, roomid: str, db: Session = Depends(get_db)
-):
+async def websocket_endpoint(websocket: WebSocket, roomid: str):
     token = websocket.query_params.get("token")
     password = websocket.query_params.get("password", "")
-    userinfo = verify_token(token, db)
-    userid = int(userinfo.id)
+    ticket = websocket.query_params.get("ticket")
     roomid = int(roomid)
 
-    room = db.query(Chatroom).filter(Chatroom.id == roomid).first()
+    # Short-lived session: a socket must not pin a pooled connection
+    async with AsyncSessionLocal() as db:
+        userinfo = await verify_token_async(token, db)
+        userid = int(userinfo.id)
+        room = await db.get(Chatroom, roomid)
+        is_member = room is not None and await check_user_inroom_async(
+            userid, roomid, db
+        )
+
     if not room:
         await websocket.close(code=1008)
         return
 
-    is_member = check_user_inroom(userid, roomid, db)
     if not is_member:
         await websocket.close(code=1008)
         return
 
-    if room.is_private:
-        if not password or not verify_password(password, room.password):
+    if room.is_private and not verify_room_ticket(ticket, userid, room):
+        try:
+            valid = bool(password) and await verify_password_async(
+                password, room.password
+            )
+        except HTTPException:
+            # Password pool saturated: ask the client to retry later
+            await websocket.close(code=1013)
+            return
+        if not valid:
             await websocket.close(code=1008)
             return
 
-    await manager.connect(websocket, roomid)
-    await send_past_messages_to_user(websocket, roomid)
+    connection = await manager.connect(websocket, roomid, userid)
+    if room.is_private:
+        await connection.send(
+            Frame.from_payload(
+                {
+                    "type": "room_ticket",
+                    "ticket": create_room_ticket(userid, room),
+                    "expires_in": ROOM_TICKET_EXPIRE_MINUTES * 60,
+                }
+            )
+        )
+    await send_past_messages_to_user(connection, roomid)
     await manager.brodcast(
-        f"{userinfo.first_name} {userinfo.last_name} is online.", roomid
+        Frame(f"{userinfo.first_name} {userinfo.last_name} is online."), roomid
     )
 
+    uploads = UploadSlot(UPLOAD_DIR)
     try:
         while True:
-            raw_data = await websocket.receive_text()
+            raw_data = await receive_message(websocket)
+            if isinstance(raw_data, bytes):
+                reply = await uploads.append(raw_data)
+                if reply is not None:
+                    await connection.send(reply)
+                continue
             try:
                 data = json.loads(raw_data)
 
                 if data["type"] == "text":
-                    stored_msg = store_and_return_message(userid, roomid, data["text"])
+                    stored_msg = await store_and_return_message(
+                        userinfo, roomid, data["text"]
+                    )
                     await manager.brodcast(
-                        f"Timestamp: {stored_msg['sent_at']}\n{stored_msg['sender']}: {stored_msg['content']}",
+                        Frame(
+                            f"Timestamp: {stored_msg['sent_at']}\n{stored_msg['sender']}: {stored_msg['content']}"
+                        ),
                         roomid,
                     )
 
-                elif data["type"] == "file":
-                    header, base64_data = data["data"].split(",", 1)
-                    file_data = base64.b64decode(base64_data)
-                    filename = f"{uuid.uuid4()}_{data['filename'].replace(' ', '_')}"
-                    filepath = os.path.join(UPLOAD_DIR, filename)
-
-                    with open(filepath, "wb") as f:
-                        f.write(file_data)
-
-                    file_url = f"/{UPLOAD_DIR}/{filename}"
-
-                    stored_msg = store_and_return_message(
-                        userid,
-                        roomid,
-                        content=data.get("text"),
-                        file_url=file_url,
-                        file_type=data["mimetype"],
-                    )
+                elif data["type"] == "read":
+                    async with AsyncSessionLocal() as db:
+                        unread = await mark_room_read_async(
+                            db, userid, roomid, data.get("message_id")
+                        )
+                    await connection.send(unread_frame(roomid, unread))
+
+                elif data["type"] == "upload_begin":
+                    await connection.send(await uploads.begin(data))
+
+                elif data["type"] == "upload_abort":
+                    await uploads.abort()
+
+                elif data["type"] in ("file", "upload_commit"):
+                    try:
+                        if data["type"] == "file":
+                            upload = await save_base64_upload(UPLOAD_DIR, data)
+                        else:
+                            upload = await uploads.commit()
+                    except UploadError as exc:
+                        await connection.send(upload_error_frame(str(exc)))
+                        continue
+
+                    try:
+                        stored_msg = await store_and_return_message(
+                            userinfo,
+                            roomid,
+                            content=upload.text,
+                            file_url=upload.url,
+                            file_type=upload.mimetype,
+                        )
+                    except Exception:
+                        await release_upload(UPLOAD_DIR, upload)
+                        raise
 
                     await manager.brodcast(
-                        json_file(
-                            stored_msg["sender"],
-                            stored_msg["message_id"],
-                            file_url,
-                            stored_msg["content"],
-                            stored_msg["sent_at"],
+                        Frame.from_payload(
+                            json_file(
+                                stored_msg["sender"],
+                                stored_msg["message_id"],
+                                upload.url,
+                                stored_msg["content"],
+                                stored_msg["sent_at"],
+                            )
                         ),
                         roomid,
                     )
+                    thumbnail_pipeline.submit(
+                        upload.url,
+                        upload.mimetype,
+                        stored_msg["message_id"],
+                        on_ready=partial(
+                            announce_thumbnails, roomid, stored_msg["message_id"]
+                        ),
+                    )
             except json.JSONDecodeError:
-                await websocket.send_text("Invalid JSON format.")
+                await connection.send(INVALID_JSON_FRAME)
                 continue  # Don't exit the loop
     except WebSocketDisconnect:
-        manager.disconnect(websocket, roomid)
+        pass
         # await manager.brodcast(f"{userinfo.first_name} {userinfo.last_name} is offline", roomid)
+    finally:
+        manager.disconnect(connection)
+        await uploads.abort()
 
 
-async def send_past_messages_to_user(websocket: WebSocket, roomid: int):
-    db = SessionLocal()
-    try:
-        results = (
-            db.query(
-                Message.content,
-                Message.id,
-                Message.file_url,
-                Message.file_type,
-                User.first_name,
-                User.last_name,
-                Message.sent_at,
-            )
-            .join(User, Message.sender_id == User.id)
-            .filter(Message.room_id == roomid)
-            .order_by(Message.sent_at)
-            .all()
-        )
+def unread_frame(roomid: int, unread: int) -> Frame:
+    return Frame.from_payload(
+        {"type": "unread", "room_id": roomid, "unread_count": unread}
+    )
 
-        for content, id, file_url, file_type, first_name, last_name, sent_at in results:
-            payload = json_file(f"{first_name} {last_name}", id, file_url, content or "", sent_at)
-            # if file_url:
-            #     if content:
-            #         message_text = f"Timestamp: {time}\n{first_name} {last_name} sent a file: {content} {file_url}"
-            #     else:
-            #         message_text = f"Timestamp: {time}\n{first_name} {last_name} sent a file: {file_url}"
-            # else:
-            #     message_text = f"Timestamp: {time}\n{first_name} {last_name}: {content}"
-            print(payload)
-            await websocket.send_text(json.dumps(payload))
-    finally:
-        db.close()
 
+async def announce_thumbnails(roomid: int, message_id: int, thumbnails: dict):
+    await manager.brodcast(thumbnail_frame(message_id, thumbnails), roomid)
 
-def store_and_return_message(
-    userid: int, room_id: int, content: str, file_url: str = None, file_type: str = None
-) -> dict:
-    db = SessionLocal()
-    try:
-        print("working")
-        new_message = Message(
-            content=content,
-            sender_id=userid,
-            room_id=room_id,
-            file_url=file_url,
-            file_type=file_type,
+
+def room_history_statement(roomid: int, before: str | None, limit: int):
+    stmt = (
+        select(
+            Message.content,
+            Message.id,
+            Message.file_url,
+            User.first_name,
+            User.last_name,
+            Message.sent_at,
+            Message.thumbnails,
         )
-        db.add(new_message)
-        db.commit()
-        db.refresh(new_message)
-        print("data sent")
+        .join(User, Message.sender_id == User.id)
+        .where(Message.room_id == roomid)
+    )
+    if before:
+        stmt = stmt.where(Message.id < decode_id_cursor(before))
+
+    # Ids only grow, so they order the history without the timestamp, whose
+    # stored precision differs between databases. Newest first so the
+    # (room_id, id) index is walked from the end, one extra row tells us
+    # whether an older page exists.
+    return stmt.order_by(Message.id.desc()).limit(limit + 1)
+
+
+def room_history_page(rows: list, limit: int) -> tuple[list[dict], str | None]:
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+
+    messages = [
+        json_file(
+            f"{first_name} {last_name}",
+            id,
+            file_url,
+            content or "",
+            sent_at,
+            small_thumbnail(thumbnails),
+        )
+        for content, id, file_url, first_name, last_name, sent_at, thumbnails in rows
+    ]
+    next_cursor = encode_id_cursor(rows[0].id) if has_more else None
+    return messages, next_cursor
 
-        user = db.query(User).filter(User.id == userid).first()
 
-        return {
-            "message_id": new_message.id,
-            "sender": f"{user.first_name}  {user.last_name}",
-            "content": new_message.content or "",
-            "file_url": new_message.file_url,
-            "sent_at": new_message.sent_at,
-        }
-    finally:
-        db.close()
+def fetch_room_history(
+    db: Session, roomid: int, before: str | None = None, limit: int = HISTORY_PAGE_SIZE
+) -> tuple[list[dict], str | None]:
+    rows = db.execute(room_history_statement(roomid, before, limit)).all()
+    return room_history_page(rows, limit)
+
+
+async def fetch_room_history_async(
+    db: AsyncSession,
+    roomid: int,
+    before: str | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> tuple[list[dict], str | None]:
+    rows = (await db.execute(room_history_statement(roomid, before, limit))).all()
+    return room_history_page(rows, limit)
+
+
+async def send_past_messages_to_user(connection: Connection, roomid: int):
+    async with AsyncSessionLocal() as db:
+        messages, next_cursor = await fetch_room_history_async(db, roomid)
+
+    for payload in messages:
+        await connection.send(Frame.from_payload(payload))
+    await connection.send(
+        Frame.from_payload({"type": "history_cursor", "next_cursor": next_cursor})
+    )
+
+
+@router.get("/chatroom/{roomid}/messages")
+def get_room_messages(
+    roomid: int,
+    before: str | None = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    if not check_user_inroom(user.id, roomid, db):
+        raise HTTPException(status_code=403, detail="You are not a member of this room")
+
+    messages, next_cursor = fetch_room_history(db, roomid, before, limit)
+    return {"messages": messages, "next_cursor": next_cursor}
+
+
+@router.post("/chatroom/{roomid}/read")
+def mark_room_messages_read(
+    roomid: int,
+    body: MarkRead | None = None,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    if not check_user_inroom(user.id, roomid, db):
+        raise HTTPException(status_code=403, detail="You are not a member of this room")
+
+    unread = mark_room_read(db, user.id, roomid, body.message_id if body else None)
+    return {"room_id": roomid, "unread_count": unread}
+
+
+async def store_and_return_message(
+    sender: User,
+    room_id: int,
+    content: str,
+    file_url: str = None,
+    file_type: str = None,
+) -> dict:
+    stored = await message_writer.submit(
+        content=content,
+        sender_id=sender.id,
+        room_id=room_id,
+        file_url=file_url,
+        file_type=file_type,
+    )
+    return {
+        "message_id": stored["id"],
+        "sender": f"{sender.first_name}  {sender.last_name}",
+        "content": content or "",
+        "file_url": file_url,
+        "sent_at": stored["sent_at"],
+    }
 
 
 @router.get("/leftchat/{roomid}")
@@ -411,14 +583,28 @@ async def left_chat(
     if not userinfo:
         return {"error": "User not found"}
 
-    membership = check_user_inroom(userid, roomid, db)
-    if membership:
+    if check_user_inroom(userid, roomid, db):
         full_name = f"{userinfo.first_name} {userinfo.last_name}"
 
-        db.query(RoomMembers).filter_by(user_id=userid, room_id=roomid).delete()
+        if db.query(RoomMembers).filter_by(user_id=userid, room_id=roomid).delete():
+            db.query(Chatroom).filter_by(id=roomid).update(
+                {
+                    Chatroom.member_count: Chatroom.member_count - 1,
+                    Chatroom.version: Chatroom.version + 1,
+                }
+            )
+        forget_room_watermark(db, userid, roomid)
         db.commit()
-
-        await manager.brodcast(json_text(full_name, "has left the chat"), roomid)
+        membership.remove(roomid, userid)
+        await membership.announce(roomid, userid, None)
+
+        await manager.brodcast(
+            Frame.from_payload(
+                json_text(full_name, None, "has left the chat", datetime.now())
+            ),
+            roomid,
+        )
+        await manager.close_user_sockets(userid, roomid)
 
         return {"message": "Leave message stored and broadcasted"}
     else:
@@ -1,102 +1,159 @@
-from datetime import datetime
-
-from fastapi import APIRouter, Depends, Header
-from sqlalchemy import and_, func, or_
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, Query, Response
+from sqlalchemy import and_, func, literal, select, tuple_, union_all
+from sqlalchemy.orm import Session, aliased
 
+from app.config import HOME_MAX_PAGE_SIZE, HOME_PAGE_SIZE
 from app.database import get_db
-from app.utils import verify_token
-from database.models import Chatroom, Message, User
+from app.pagination import decode_cursor, encode_cursor
+from app.utils import get_current_user, verify_token
+from database.models import (
+    Chatroom,
+    ConversationSummary,
+    Message,
+    ReadWatermark,
+    RoomMembers,
+    User,
+)
 
 router = APIRouter()
 
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
 
-@router.get("/home")
-def get_all_messages(authorization: str = Header(...), db: Session = Depends(get_db)):
-    userinfo = verify_token(authorization, db)
 
-    # 1. PERSONAL MESSAGES
-    personal_msgs = (
-        db.query(Message, User.first_name, User.last_name, User.username)
-        .join(User, Message.receiver_id == User.id)
-        .filter(
+def home_statement(user_id: int, before: str | None, limit: int):
+    summary = ConversationSummary
+    # The other user's entry for the same DM conversation: their unread
+    # count is how many of this user's messages are still only delivered
+    counterpart = aliased(ConversationSummary)
+
+    stmt = (
+        select(
+            summary,
+            Message.sender_id,
+            Message.status,
+            User.first_name,
+            User.last_name,
+            User.username,
+            Chatroom.roomname,
+            counterpart.unread_count,
+        )
+        .join(Message, Message.id == summary.last_message_id)
+        .outerjoin(User, and_(summary.kind == "personal", User.id == summary.target_id))
+        .outerjoin(Chatroom, and_(summary.kind == "group", Chatroom.id == summary.target_id))
+        .outerjoin(
+            counterpart,
             and_(
-                Message.sender_id == userinfo.id,
-                or_(Message.status == "delivered", Message.status == "read"),
-            )
+                summary.kind == "personal",
+                counterpart.user_id == summary.target_id,
+                counterpart.kind == "personal",
+                counterpart.target_id == summary.user_id,
+            ),
         )
-        .order_by(Message.receiver_id, Message.sent_at.desc())
-        .all()
+        .where(summary.user_id == user_id)
     )
+    if before:
+        keyset = decode_cursor(before)
+        stmt = stmt.where(
+            tuple_(summary.last_sent_at, summary.last_message_id) < tuple_(*keyset)
+        )
+    return stmt.order_by(
+        summary.last_sent_at.desc(), summary.last_message_id.desc()
+    ).limit(limit + 1)
 
-    personal_grouped = {}
-    for message, first_name, last_name, username in personal_msgs:
-        rid = message.receiver_id
-        if rid not in personal_grouped:
-            personal_grouped[rid] = {
-                "type": "personal",
-                "receiver_id": rid,
-                "receiver_full_name": f"{first_name} {last_name}",
-                "username": username,
-                "delivered_count": 0,
-                "last_message": {
-                    "message_id": message.id,
-                    "content": message.content,
-                    "status": message.status,
-                    "timestamp": message.sent_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
-                    "file_url": message.file_url,
-                    "file_type": message.file_type,
-                },
-            }
-        if message.status == "delivered":
-            personal_grouped[rid]["delivered_count"] += 1
-
-    # 2. GROUP CHAT MESSAGES
-    subq = (
-        db.query(Message.room_id, func.max(Message.sent_at).label("latest_sent_at"))
-        .filter(Message.sender_id == userinfo.id)
-        .group_by(Message.room_id)
-        .subquery()
-    )
 
-    group_results = (
-        db.query(Chatroom.id, Chatroom.roomname, Message.content, Message.sent_at)
-        .join(Message, Chatroom.id == Message.room_id)
-        .join(
-            subq,
-            (Message.room_id == subq.c.room_id)
-            & (Message.sent_at == subq.c.latest_sent_at),
-        )
-        .filter(Message.sender_id == userinfo.id)
-        .all()
-    )
+def home_entry(row) -> dict:
+    summary, sender_id, status, first_name, last_name, username, roomname, delivered = row
+    timestamp = summary.last_sent_at.strftime(TIMESTAMP_FORMAT)
+    if summary.kind == "group":
+        return {
+            "type": "group",
+            "room_id": summary.target_id,
+            "roomname": roomname,
+            "content": summary.last_content,
+            "timestamp": timestamp,
+        }
+    return {
+        "type": "personal",
+        "receiver_id": summary.target_id,
+        "receiver_full_name": f"{first_name} {last_name}",
+        "username": username,
+        "delivered_count": delivered or 0,
+        "unread_count": summary.unread_count,
+        "last_message": {
+            "message_id": summary.last_message_id,
+            "sender_id": sender_id,
+            "content": summary.last_content,
+            "status": status,
+            "timestamp": timestamp,
+            "file_url": summary.last_file_url,
+            "file_type": summary.last_file_type,
+        },
+    }
 
-    # 3. Merge and Sort
-    combined = []
 
-    # Add personal
-    combined.extend(personal_grouped.values())
+@router.get("/home")
+def get_all_messages(
+    response: Response,
+    before: str | None = None,
+    limit: int = Query(HOME_PAGE_SIZE, ge=1, le=HOME_MAX_PAGE_SIZE),
+    authorization: str = Header(...),
+    db: Session = Depends(get_db),
+):
+    userinfo = verify_token(authorization, db)
 
-    # Add group
-    for id, roomname, content, sent_at in group_results:
-        combined.append(
-            {
-                "type": "group",
-                "room_id": id,
-                "roomname": roomname,
-                "content": content,
-                "timestamp": sent_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
-            }
+    rows = db.execute(home_statement(userinfo.id, before, limit)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        # The body stays a plain list; the next page is named in a header
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            last.last_sent_at, last.last_message_id
         )
+    return [home_entry(row) for row in rows]
 
-    # Unified sort by latest timestamp
-    def get_timestamp(entry):
-        if entry["type"] == "personal":
-            return datetime.strptime(
-                entry["last_message"]["timestamp"], "%Y-%m-%d %H:%M:%S.%f"
-            )
-        return datetime.strptime(entry["timestamp"], "%Y-%m-%d %H:%M:%S.%f")
 
-    combined.sort(key=get_timestamp, reverse=True)
+def unread_statement(user_id: int):
+    # Room badges are the room's message counter minus the member's read
+    # watermark; DM badges are the counters kept on the conversation summary.
+    rooms = (
+        select(
+            literal("room").label("kind"),
+            RoomMembers.room_id.label("target_id"),
+            (Chatroom.message_count - func.coalesce(ReadWatermark.read_count, 0)).label(
+                "unread_count"
+            ),
+        )
+        .join(Chatroom, Chatroom.id == RoomMembers.room_id)
+        .outerjoin(
+            ReadWatermark,
+            and_(
+                ReadWatermark.user_id == RoomMembers.user_id,
+                ReadWatermark.kind == "room",
+                ReadWatermark.target_id == RoomMembers.room_id,
+            ),
+        )
+        .where(RoomMembers.user_id == user_id)
+    )
+    personal = select(
+        literal("personal").label("kind"),
+        ConversationSummary.target_id,
+        ConversationSummary.unread_count,
+    ).where(
+        ConversationSummary.user_id == user_id,
+        ConversationSummary.kind == "personal",
+        ConversationSummary.unread_count > 0,
+    )
+    return union_all(rooms, personal)
+
 
-    return combined
+@router.get("/unread")
+def get_unread_counts(
+    db: Session = Depends(get_db), user: User = Depends(get_current_user)
+):
+    rooms, personal = [], []
+    for kind, target_id, unread_count in db.execute(unread_statement(user.id)):
+        if kind == "room":
+            rooms.append({"room_id": target_id, "unread_count": max(unread_count, 0)})
+        else:
+            personal.append({"user_id": target_id, "unread_count": unread_count})
+    return {"rooms": rooms, "personal": personal}
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+
+from app.metrics import metrics
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
@@ -1,5 +1,4 @@
 import os
-import uuid
 
 from fastapi import (
     APIRouter,
@@ -11,11 +10,21 @@ from fastapi import (
     UploadFile,
     status,
 )
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from app import schemas
+from app.attachments import release_attachment, release_blob, thumbnails_of
+from app.autocomplete import autocomplete
 from app.database import get_db
-from app.utils import get_current_user, hash_password, verify_password
+from app.thumbnails import small_thumbnail, thumbnail_pipeline
+from app.uploads import save_upload_file
+from app.utils import (
+    get_current_user,
+    hash_password,
+    invalidate_user,
+    verify_password,
+)
 from database import models
 
 UPLOAD_PROFILE_DIR = os.path.join("uploads", "profile_pics")
@@ -24,15 +33,26 @@ os.makedirs(UPLOAD_PROFILE_DIR, exist_ok=True)
 router = APIRouter(prefix="/profile", tags=["Profile"])
 
 
+def with_image_urls(request: Request, db: Session, user: models.User) -> models.User:
+    if user.profile_image:
+        thumbnail = small_thumbnail(
+            db.scalar(select(thumbnails_of(UPLOAD_PROFILE_DIR, user.profile_image)))
+        )
+        if thumbnail:
+            user.profile_image_thumbnail = str(request.base_url) + thumbnail.lstrip("/")
+        user.profile_image = (
+            str(request.base_url) + "profile_images/" + user.profile_image
+        )
+    return user
+
+
 @router.get("/", response_model=schemas.UserOut)
 def get_profile(
-    request: Request, current_user: models.User = Depends(get_current_user)
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
 ):
-    if current_user.profile_image:
-        current_user.profile_image = (
-            str(request.base_url) + "profile_images/" + current_user.profile_image
-        )
-    return current_user
+    return with_image_urls(request, db, current_user)
 
 
 @router.put("/update", response_model=schemas.UserOut)
@@ -55,27 +75,23 @@ async def update_profile(
     if email is not None:
         current_user.email = email
 
+    old_image = current_user.profile_image
     if profile_image:
-        if current_user.profile_image:
-            old_path = os.path.join("uploads", current_user.profile_image)
-            if os.path.exists(old_path):
-                os.remove(old_path)
-
-        ext = profile_image.filename.split(".")[-1]
-        new_filename = f"profile_{uuid.uuid4()}.{ext}"
-        file_path = os.path.join(UPLOAD_PROFILE_DIR, new_filename)
-        with open(file_path, "wb") as f:
-            f.write(await profile_image.read())
-
-        current_user.profile_image = new_filename
+        current_user.profile_image = await save_upload_file(
+            profile_image, UPLOAD_PROFILE_DIR
+        )
+        thumbnail_pipeline.submit(
+            f"/{UPLOAD_PROFILE_DIR}/{current_user.profile_image}",
+            profile_image.content_type,
+        )
     db.commit()
+    invalidate_user(current_user.id)
+    autocomplete.add_user(current_user)
+    if old_image and profile_image:
+        await release_attachment(UPLOAD_PROFILE_DIR, old_image)
     db.refresh(current_user)
-    if current_user.profile_image:
-        current_user.profile_image = (
-            str(request.base_url) + "profile_images/" + current_user.profile_image
-        )
 
-    return current_user
+    return with_image_urls(request, db, current_user)
 
 
 @router.put("/change-password")
@@ -88,6 +104,7 @@ def change_password(
         raise HTTPException(status_code=400, detail="old password is incorrect")
     current_user.password = hash_password(payload.new_password)
     db.commit()
+    invalidate_user(current_user.id)
     return {"detail": "Password updated successfully"}
 
 
@@ -98,10 +115,9 @@ def delete_profile_image(
     if not current_user.profile_image:
         raise HTTPException(status_code=404, detail="No profile image found")
 
-    file_path = os.path.join("uploads", current_user.profile_image)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
+    old_image = current_user.profile_image
     current_user.profile_image = None
     db.commit()
+    invalidate_user(current_user.id)
+    release_blob(UPLOAD_PROFILE_DIR, old_image)
     return {"detail": "Profile image deleted"}
@@ -1,35 +1,133 @@
-from fastapi import APIRouter, Depends, Query,Request
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import func, or_, select
 from sqlalchemy.orm import Session
 
+from app.attachments import thumbnails_of
+from app.autocomplete import autocomplete
+from app.config import SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE
 from app.database import get_db
+from app.message_search import search_page, search_statement
+from app.thumbnails import small_thumbnail
+from app.utils import check_user_inroom, get_current_user
 from database.models import Chatroom, RoomMembers, User
 
 router = APIRouter(prefix="/search", tags=["Search"])
 
 
+SEARCH_LIMIT = 10
+
+UPLOAD_PROFILE_DIR = os.path.join("uploads", "profile_pics")
+UPLOAD_GROUP_DIR = os.path.join("uploads", "group-image")
+
+USER_FIELDS = (
+    User.id,
+    User.username,
+    User.first_name,
+    User.last_name,
+    User.profile_image,
+    thumbnails_of(UPLOAD_PROFILE_DIR, User.profile_image).label("thumbnails"),
+)
+ROOM_FIELDS = (
+    Chatroom.id,
+    Chatroom.roomname,
+    Chatroom.image,
+    Chatroom.is_private,
+    thumbnails_of(UPLOAD_GROUP_DIR, Chatroom.image).label("thumbnails"),
+)
+
+
+def with_thumbnail(row, key: str) -> dict:
+    # Only the small variant goes out, next to the original's name
+    result = row._asdict()
+    result[key] = small_thumbnail(result.pop("thumbnails"))
+    return result
+
+
+def name_match(column, query: str, dialect: str):
+    """Filter and ordering for a name search: substring matches, plus close
+    misspellings on PostgreSQL, with prefix matches first. Both are served
+    by the pg_trgm indexes."""
+    name = func.lower(column)
+    term = query.lower()
+    condition = name.contains(term, autoescape=True)
+    order = [name.startswith(term, autoescape=True).desc()]
+    if dialect == "postgresql":
+        condition = or_(condition, name.op("%")(term))
+        order.append(func.similarity(name, term).desc())
+    order.append(name)
+    return condition, order
+
+
 @router.get("/users")
 def search_users(query: str = Query(..., min_length=1), db: Session = Depends(get_db)):
-    return db.query(User).filter(User.username.ilike(f"{query}%")).limit(10).all()
+    condition, order = name_match(User.username, query, db.bind.dialect.name)
+    rows = db.execute(
+        select(*USER_FIELDS).where(condition).order_by(*order).limit(SEARCH_LIMIT)
+    )
+    return [with_thumbnail(row, "profile_image_thumbnail") for row in rows]
 
 
 @router.get("/rooms")
 def search_rooms(query: str = Query(..., min_length=1), db: Session = Depends(get_db)):
-    return (
-        db.query(Chatroom).filter(Chatroom.roomname.ilike(f"{query}%")).limit(10).all()
+    condition, order = name_match(Chatroom.roomname, query, db.bind.dialect.name)
+    rows = db.execute(
+        select(*ROOM_FIELDS).where(condition).order_by(*order).limit(SEARCH_LIMIT)
     )
+    return [with_thumbnail(row, "image_thumbnail") for row in rows]
 
 
 @router.get("/users-in-room")
 def search_users_in_room(
     room_id: int, query: str = Query(..., min_length=1), db: Session = Depends(get_db)
 ):
-    return (
-        db.query(User)
-        .join(RoomMembers)
-        .filter(RoomMembers.room_id == room_id, User.username.ilike(f"{query}%"))
-        .limit(10)
-        .all()
+    condition, order = name_match(User.username, query, db.bind.dialect.name)
+    rows = db.execute(
+        select(*USER_FIELDS)
+        .join(RoomMembers, RoomMembers.user_id == User.id)
+        .where(RoomMembers.room_id == room_id, condition)
+        .order_by(*order)
+        .limit(SEARCH_LIMIT)
+    )
+    return [with_thumbnail(row, "profile_image_thumbnail") for row in rows]
+
+
+@router.get("/autocomplete")
+def autocomplete_names(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=50),
+    db: Session = Depends(get_db),
+):
+    # Answered from memory; the database is only read to (re)load the index
+    autocomplete.ensure_loaded(db)
+    return {
+        "users": autocomplete.users.search(q, limit),
+        "rooms": autocomplete.rooms.search(q, limit),
+    }
+
+
+@router.get("/messages")
+def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    room_id: int | None = None,
+    peer_id: int | None = None,
+    cursor: str | None = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    if room_id is not None and not check_user_inroom(user.id, room_id, db):
+        raise HTTPException(status_code=403, detail="You are not a member of this room")
+    if not q.strip():
+        return {"results": [], "next_cursor": None}
+
+    stmt = search_statement(
+        db.bind.dialect.name, user.id, q, room_id, peer_id, cursor, limit
     )
+    results, next_cursor = search_page(db.execute(stmt).all(), limit)
+    return {"results": results, "next_cursor": next_cursor}
+
 
 # @router.get("/users/{user_id}")
 # def get_single_user(user_id: int, db: Session = Depends(get_db)):
@@ -61,10 +159,17 @@ def get_single_user(
         request.url_for("uploads", path=f"profile_pics/{user.profile_image}")
         if user.profile_image else None
     )
+    thumbnail_url = (
+        small_thumbnail(
+            db.scalar(select(thumbnails_of(UPLOAD_PROFILE_DIR, user.profile_image)))
+        )
+        if user.profile_image else None
+    )
 
     return {
         "id": user.id,
         "full_name": f"{user.first_name} {user.last_name}",
         "profile_image": image_url,
+        "profile_image_thumbnail": thumbnail_url,
         "email": user.email,
     }
\ No newline at end of file
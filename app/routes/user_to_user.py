@@ -1,19 +1,50 @@
-from fastapi import WebSocket, APIRouter, Depends, WebSocketDisconnect, Header
-from app.database import get_db, SessionLocal
-from sqlalchemy.orm import Session
-from app.utils import verify_token, verify_user
-from app.connection_manager import UserConnectionManager
-from fastapi.responses import HTMLResponse
-from database.models import Message, User
-from sqlalchemy import or_, and_
-import base64
-import uuid
 import json
+import logging
 import os
-from contextlib import contextmanager
+from functools import partial
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import HTMLResponse
+from sqlalchemy import case, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.backplane import backplane
+from app.config import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE
+from app.connection_manager import Connection, UserConnectionManager
+from app.database import AsyncSessionLocal, get_db
+from app.frames import Frame
+from app.message_writer import message_writer
+from app.pagination import decode_id_cursor, encode_id_cursor
+from app.thumbnails import small_thumbnail, thumbnail_frame, thumbnail_pipeline
+from app.uploads import (
+    UploadError,
+    UploadSlot,
+    receive_message,
+    release_upload,
+    save_base64_upload,
+    upload_error_frame,
+)
+from app.utils import (
+    get_current_user,
+    verify_token_async,
+    verify_user,
+    verify_user_async,
+)
+from app.watermarks import upsert_watermarks
+from database.models import ConversationSummary, Message, MessageStatus, User
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 html = """
 <!DOCTYPE html>
 <html>
@@ -37,6 +68,7 @@ html = """
 
         <script>
             var ws = null;
+            const CHUNK_SIZE = 256 * 1024;
 
             function CreateConnection(event){
                 event.preventDefault();
@@ -66,21 +98,20 @@ html = """
                 status =  "sending"
                 if (ws && ws.readyState === WebSocket.OPEN) {
                     if(file){
-                        const reader= new FileReader();
-                        reader.onload = () => {
-                            const base64 = reader.result;
-                            const payload = {
-                                type: "file",
-                                filename: file.name,
-                                mimetype: file.type,
-                                data: base64,
-                                text: msg
-                            };
-                            ws.send(JSON.stringify(payload));
-                            document.getElementById("message").value = "";
-                            document.getElementById("fileInput").value = "";
-                        };
-                        reader.readAsDataURL(file);
+                        // Stream the file as binary frames instead of one base64 blob
+                        ws.send(JSON.stringify({
+                            type: "upload_begin",
+                            filename: file.name,
+                            mimetype: file.type,
+                            size: file.size,
+                            text: msg
+                        }));
+                        for (let offset = 0; offset < file.size; offset += CHUNK_SIZE) {
+                            ws.send(file.slice(offset, offset + CHUNK_SIZE));
+                        }
+                        ws.send(JSON.stringify({ type: "upload_commit" }));
+                        document.getElementById("message").value = "";
+                        document.getElementById("fileInput").value = "";
                     } else{
                         ws.send(JSON.stringify({
                             type: "text",
@@ -117,15 +148,9 @@ html = """
 UPLOAD_DIR = "uploads/messages"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-usermanager = UserConnectionManager()
+usermanager = UserConnectionManager(backplane)
 
-@contextmanager
-def get_db_session():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+INVALID_JSON_FRAME = Frame("Invalid JSON format.")
 
 def build_message_dict(msg, sender_name, include_file_url_key=True, msg_type="message_history"):
     base = {
@@ -134,7 +159,8 @@ def build_message_dict(msg, sender_name, include_file_url_key=True, msg_type="me
         "timestamp": msg.sent_at.strftime("%Y-%m-%d %H:%M:%S"),
         "sender": sender_name,
         "content": msg.content if msg.content else None,
-        "status": msg.status
+        "status": msg.status,
+        "thumbnail_url": small_thumbnail(msg.thumbnails),
     }
     # Use consistent "file_url" key in message dict
     if include_file_url_key:
@@ -143,168 +169,319 @@ def build_message_dict(msg, sender_name, include_file_url_key=True, msg_type="me
         base["file_url"] = msg.file_url if msg.file_url else None
     return base
 
-async def send_message(websocket: WebSocket, msg_dict: dict):
-    await websocket.send_text(json.dumps(msg_dict))
+async def send_message(connection: Connection, frame: Frame):
+    await connection.send(frame)
 
 @router.get("/")
 def display():
     return HTMLResponse(html)
 
 @router.websocket("/userchat/{receiverid}")
-async def user_websocket_endpoint(websocket: WebSocket, receiverid: str, db: Session = Depends(get_db)):
+async def user_websocket_endpoint(websocket: WebSocket, receiverid: str):
     token = websocket.query_params.get("token")
-    userinfo = verify_token(token, db)
+    receiver_id = int(receiverid)
+    async with AsyncSessionLocal() as db:
+        userinfo = await verify_token_async(token, db)
+        receiver_exist = await verify_user_async(receiver_id, db)
     if not userinfo:
         await websocket.close(code=1008)
         return
 
     sender_id = int(userinfo.id)
-    receiver_id = int(receiverid)
 
-    receiver_exist = verify_user(receiver_id, db)
     if not receiver_exist:
         await websocket.close(code=1008)
         return
     
-    await usermanager.connect(sender_id, receiver_id, websocket)
-    await send_past_message(websocket, sender_id, receiver_id)
+    connection = await usermanager.connect(sender_id, receiver_id, websocket)
+    await send_past_message(connection, sender_id, receiver_id)
 
+    uploads = UploadSlot(UPLOAD_DIR)
     try:
         while True:
-            raw_data = await websocket.receive_text()
+            raw_data = await receive_message(websocket)
+            if isinstance(raw_data, bytes):
+                reply = await uploads.append(raw_data)
+                if reply is not None:
+                    await send_message(connection, reply)
+                continue
             try:
                 data = json.loads(raw_data)
 
                 if data["type"] == "text":
-                    stored_msg = store_and_return_msg(data["text"], sender_id, receiver_id)
+                    stored_msg = await store_and_return_msg(data["text"], userinfo, receiver_id)
                     # Notify both parties
-                    await usermanager.send_msg(sender_id, receiver_id, {
+                    await usermanager.send_msg(sender_id, receiver_id, Frame.from_payload({
                         **stored_msg,
                         "type": "status_update",
                         "status": "sent"
-                    })
-
-                    update_status("delivered", stored_msg["message_id"])
+                    }))
 
-                    await websocket.send_text(json.dumps({
+                    await send_message(connection, Frame.from_payload({
                         **stored_msg,
                         "type": "status_update",
                         "status": "delivered"
                     }))
 
-                elif data["type"] == "file":
-                    header, base64_data = data["data"].split(",", 1)
-                    file_data = base64.b64decode(base64_data)
-                    filename = f"{uuid.uuid4()}_{data['filename'].replace(' ', '_')}"
-                    filepath = os.path.join(UPLOAD_DIR, filename)
-
-                    with open(filepath, "wb") as f:
-                        f.write(file_data)
-
-                    file_url = f"/{UPLOAD_DIR}/{filename}"
-
-                    stored_msg = store_and_return_msg(
-                        content=data.get("text"),
-                        sender_id=sender_id,
-                        receiver_id=receiver_id,
-                        file_url=file_url,
-                        file_type=data["mimetype"]
-                    )
-
-                    await usermanager.send_msg(sender_id, receiver_id, {
+                elif data["type"] == "upload_begin":
+                    await send_message(connection, await uploads.begin(data))
+
+                elif data["type"] == "upload_abort":
+                    await uploads.abort()
+
+                elif data["type"] in ("file", "upload_commit"):
+                    try:
+                        if data["type"] == "file":
+                            upload = await save_base64_upload(UPLOAD_DIR, data)
+                        else:
+                            upload = await uploads.commit()
+                    except UploadError as exc:
+                        await send_message(connection, upload_error_frame(str(exc)))
+                        continue
+
+                    try:
+                        stored_msg = await store_and_return_msg(
+                            content=upload.text,
+                            sender=userinfo,
+                            receiver_id=receiver_id,
+                            file_url=upload.url,
+                            file_type=upload.mimetype
+                        )
+                    except Exception:
+                        await release_upload(UPLOAD_DIR, upload)
+                        raise
+
+                    await usermanager.send_msg(sender_id, receiver_id, Frame.from_payload({
                         **stored_msg,
                         "type": "status_update",
                         "status": "sent"
-                    })
-
-                    update_status("delivered", stored_msg["message_id"])
+                    }))
 
-                    await websocket.send_text(json.dumps({
+                    await send_message(connection, Frame.from_payload({
                         **stored_msg,
                         "type": "status_update",
                         "status": "delivered"
                     }))
+                    thumbnail_pipeline.submit(
+                        upload.url,
+                        upload.mimetype,
+                        stored_msg["message_id"],
+                        on_ready=partial(
+                            announce_thumbnails, sender_id, receiver_id, stored_msg["message_id"]
+                        ),
+                    )
 
                 elif data["type"] == "read":
-                    message_id = data["message_id"]
-                    with get_db_session() as db:
-                        msg = db.query(Message).filter(Message.id == message_id).first()
-                        if msg and msg.receiver_id == sender_id:
-                            update_status("read", message_id)
-                            sender = db.query(User).filter(User.id == msg.sender_id).first()
-                            status_msg = build_message_dict(msg, f"{sender.first_name} {sender.last_name}", include_file_url_key=True, msg_type="status_update")
-                            status_msg["status"] = "read"
-                            await websocket.send_text(json.dumps(status_msg))
-                            # Notify sender if connected
-                            await usermanager.send_msg(msg.sender_id, msg.receiver_id, status_msg)
+                    # Watermark: everything the peer sent up to this id is read
+                    up_to = int(data["message_id"])
+                    if await mark_read_up_to(sender_id, receiver_id, up_to):
+                        # One event per watermark, to both sides of the conversation
+                        await usermanager.send_msg(
+                            receiver_id, sender_id, read_receipt_frame(sender_id, up_to)
+                        )
 
             except json.JSONDecodeError:
-                await websocket.send_text("Invalid JSON format.")
+                await send_message(connection, INVALID_JSON_FRAME)
                 continue
     except WebSocketDisconnect:
-        await usermanager.disconnect(sender_id, receiver_id, websocket)
-        print(userinfo.first_name, "disconnected")
-
-async def send_past_message(websocket: WebSocket, sender_id: int, receiver_id: int):
-    with get_db_session() as db:
-        chat_history = (
-            db.query(Message, User.first_name, User.last_name)
-            .join(User, Message.sender_id == User.id)
-            .filter(
-                or_(
-                    and_(Message.sender_id == sender_id, Message.receiver_id == receiver_id),
-                    and_(Message.sender_id == receiver_id, Message.receiver_id == sender_id)
-                )
+        logger.info("%s disconnected", userinfo.first_name)
+    finally:
+        usermanager.disconnect(connection)
+        await uploads.abort()
+
+async def announce_thumbnails(sender_id: int, receiver_id: int, message_id: int, thumbnails: dict):
+    await usermanager.send_msg(sender_id, receiver_id, thumbnail_frame(message_id, thumbnails))
+
+def _dm_side(sender_id: int, receiver_id: int, before_id: int | None, limit: int):
+    side = select(Message.id).where(
+        Message.sender_id == sender_id, Message.receiver_id == receiver_id
+    )
+    if before_id is not None:
+        side = side.where(Message.id < before_id)
+    return side.order_by(Message.id.desc()).limit(limit).subquery()
+
+
+def dm_history_statement(user_id: int, peer_id: int, before: str | None, limit: int):
+    before_id = decode_id_cursor(before) if before else None
+
+    # Each direction of the conversation is its own range scan on
+    # (sender_id, receiver_id, id); merging two limit+1 slices is cheaper
+    # than an OR over the whole table.
+    outgoing = _dm_side(user_id, peer_id, before_id, limit + 1)
+    incoming = _dm_side(peer_id, user_id, before_id, limit + 1)
+    page_ids = union_all(select(outgoing.c.id), select(incoming.c.id))
+
+    return (
+        select(Message, User.first_name, User.last_name)
+        .join(User, Message.sender_id == User.id)
+        .where(Message.id.in_(page_ids))
+        .order_by(Message.id.desc())
+        .limit(limit + 1)
+    )
+
+
+def dm_history_page(rows: list, limit: int) -> tuple[list[dict], str | None]:
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+
+    messages = [
+        build_message_dict(msg, f"{first_name} {last_name}")
+        for msg, first_name, last_name in rows
+    ]
+    oldest = rows[0][0] if rows else None
+    next_cursor = encode_id_cursor(oldest.id) if has_more else None
+    return messages, next_cursor
+
+
+def fetch_dm_history(
+    db: Session,
+    user_id: int,
+    peer_id: int,
+    before: str | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> tuple[list[dict], str | None]:
+    rows = db.execute(dm_history_statement(user_id, peer_id, before, limit)).all()
+    return dm_history_page(rows, limit)
+
+
+async def fetch_dm_history_async(
+    db: AsyncSession,
+    user_id: int,
+    peer_id: int,
+    before: str | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> tuple[list[dict], str | None]:
+    stmt = dm_history_statement(user_id, peer_id, before, limit)
+    rows = (await db.execute(stmt)).all()
+    return dm_history_page(rows, limit)
+
+
+async def send_past_message(connection: Connection, sender_id: int, receiver_id: int):
+    async with AsyncSessionLocal() as db:
+        messages, next_cursor = await fetch_dm_history_async(db, sender_id, receiver_id)
+    for msg_dict in messages:
+        await send_message(connection, Frame.from_payload(msg_dict))
+    await send_message(
+        connection, Frame.from_payload({"type": "history_cursor", "next_cursor": next_cursor})
+    )
+
+
+@router.get("/userchat/{receiverid}/messages")
+def get_dm_messages(
+    receiverid: int,
+    before: str | None = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    if not verify_user(receiverid, db):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    messages, next_cursor = fetch_dm_history(db, user.id, receiverid, before, limit)
+    return {"messages": messages, "next_cursor": next_cursor}
+
+async def store_and_return_msg(content: str, sender: User, receiver_id: int, file_url: str = None, file_type: str = None) -> dict:
+    # The message is handed to the recipient's sockets right after it is
+    # stored, so it is written as delivered instead of updated a second time.
+    new_message = Message(
+        content=content,
+        sender_id=sender.id,
+        file_url=file_url,
+        file_type=file_type,
+        receiver_id=receiver_id,
+        status=MessageStatus.delivered
+    )
+    stored = await message_writer.submit(
+        content=content,
+        sender_id=sender.id,
+        receiver_id=receiver_id,
+        file_url=file_url,
+        file_type=file_type,
+        status=MessageStatus.delivered,
+    )
+    new_message.id = stored["id"]
+    new_message.sent_at = stored["sent_at"]
+    sender_name = f"{sender.first_name} {sender.last_name}"
+    return build_message_dict(new_message, sender_name, include_file_url_key=False)
+
+# Read watermark: one set-based UPDATE for every message peer_id sent to
+# reader_id up to and including up_to; the reader's unread count for the
+# conversation drops by as many and their watermark moves to up_to.
+# Returns how many rows changed.
+async def mark_read_up_to(reader_id: int, peer_id: int, up_to: int) -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Message)
+            .where(
+                Message.sender_id == peer_id,
+                Message.receiver_id == reader_id,
+                Message.id <= up_to,
+                Message.status != MessageStatus.read,
             )
-            .order_by(Message.sent_at)
-            .all()
-        )
-        for msg, first_name, last_name in chat_history:
-            sender_name = f"{first_name} {last_name}"
-            msg_dict = build_message_dict(msg, sender_name)
-            await send_message(websocket, msg_dict)
-
-def store_and_return_msg(content: str, sender_id: int, receiver_id: int, file_url: str = None, file_type: str = None) -> dict:
-    with get_db_session() as db:
-        new_message = Message(
-            content=content,
-            sender_id=sender_id,
-            file_url=file_url,
-            file_type=file_type,
-            receiver_id=receiver_id,
-            status="sent"
+            .values(status=MessageStatus.read)
+            .execution_options(synchronize_session=False)
         )
-        db.add(new_message)
-        db.commit()
-        db.refresh(new_message)
-
-        user = db.query(User).filter(User.id == sender_id).first()
-        sender_name = f"{user.first_name} {user.last_name}"
-        return build_message_dict(new_message, sender_name, include_file_url_key=False)
-
-def update_status(status: str, message_id: int):
-    with get_db_session() as db:
-        msg = db.query(Message).filter(Message.id == message_id).first()
-        if msg:
-            msg.status = status
-            db.commit()
-            return True
-    return False
+        if result.rowcount:
+            await db.execute(
+                update(ConversationSummary)
+                .where(
+                    ConversationSummary.user_id == reader_id,
+                    ConversationSummary.kind == "personal",
+                    ConversationSummary.target_id == peer_id,
+                )
+                .values(
+                    unread_count=case(
+                        (
+                            ConversationSummary.unread_count > result.rowcount,
+                            ConversationSummary.unread_count - result.rowcount,
+                        ),
+                        else_=0,
+                    )
+                )
+            )
+            await db.execute(
+                upsert_watermarks(
+                    db.bind.dialect.name,
+                    [
+                        {
+                            "user_id": reader_id,
+                            "kind": "personal",
+                            "target_id": peer_id,
+                            "last_read_message_id": up_to,
+                            "read_count": None,
+                        }
+                    ],
+                )
+            )
+        await db.commit()
+        return result.rowcount
+
+
+def read_receipt_frame(reader_id: int, up_to: int) -> Frame:
+    return Frame.from_payload({
+        "type": "read_receipt",
+        "status": "read",
+        "reader_id": reader_id,
+        "up_to_message_id": up_to,
+    })
 
 # frontend-url = `ws://localhost:8000/readstatus?messageid=${messageId}&receivertoken=${receiverToken}`;
 # receivertoken mean logged in user ko token
 @router.websocket("/readstatus")
-async def readstatus(websocket: WebSocket, messageid: int, receivertoken: str, db: Session = Depends(get_db)):
+async def readstatus(websocket: WebSocket, messageid: int, receivertoken: str):
     await websocket.accept()
 
     try:
-        userinfo = verify_token(receivertoken, db)
+        async with AsyncSessionLocal() as db:
+            userinfo = await verify_token_async(receivertoken, db)
+            msg = await db.get(Message, messageid)
+            sender = await db.get(User, msg.sender_id) if msg else None
         if not userinfo:
             await websocket.send_text(json.dumps({"error": "Invalid token"}))
             await websocket.close()
             return
 
-        msg = db.query(Message).filter(Message.id == messageid).first()
         if not msg:
             await websocket.send_text(json.dumps({"error": "Message not found"}))
             await websocket.close()
@@ -315,10 +492,12 @@ async def readstatus(websocket: WebSocket, messageid: int, receivertoken: str, d
             await websocket.close()
             return
 
-        # Update status
-        update_status("read", messageid)
+        # Update status: everything up to this message is read
+        if await mark_read_up_to(userinfo.id, msg.sender_id, messageid):
+            await usermanager.send_msg(
+                msg.sender_id, userinfo.id, read_receipt_frame(userinfo.id, messageid)
+            )
 
-        sender = db.query(User).filter(User.id == msg.sender_id).first()
         timestamp = msg.sent_at.strftime("%Y-%m-%d %H:%M:%S")
 
         await websocket.send_text(json.dumps({
@@ -332,7 +511,7 @@ async def readstatus(websocket: WebSocket, messageid: int, receivertoken: str, d
         }))
 
     except WebSocketDisconnect:
-        print("WebSocket disconnected")
+        logger.info("WebSocket disconnected")
 
     except Exception as e:
         await websocket.send_text(json.dumps({"error": str(e)}))
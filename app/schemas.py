@@ -35,6 +35,7 @@ class UserOut(BaseModel):
     email: EmailStr
     created_at: datetime
     profile_image: str | None
+    profile_image_thumbnail: str | None = None
 
     class Config:
         orm_mode = True
@@ -62,6 +63,11 @@ class JoinRoom(BaseModel):
     password: str | None = None
 
 
+class MarkRead(BaseModel):
+    # Defaults to the newest message in the room
+    message_id: int | None = None
+
+
 class LastMessageResponse(BaseModel):
     roomname: str
     content: str
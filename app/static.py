@@ -0,0 +1,55 @@
+import os
+import re
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from app.config import STATIC_MAX_AGE
+from app.metrics import metrics
+
+# <sha256>.<ext> from the attachment store, or a thumbnail of one
+_CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})(_\w+)?\.")
+
+
+class AttachmentResponse(FileResponse):
+    # Used when the server has no pathsend support; fewer, larger reads
+    # for media than the 64 KiB default
+    chunk_size = 256 * 1024
+
+
+class AttachmentFiles(StaticFiles):
+    """StaticFiles for uploaded files, which never change once written.
+
+    Every upload lives under a unique name (a content hash or a uuid), so
+    responses are marked immutable with a long max-age. Content-addressed
+    files get their hash as a strong ETag, which stays the same across
+    servers and redeploys. Range requests and zero-copy pathsend come from
+    FileResponse.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        # Uploads still being written are never served
+        if path.endswith(".part"):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(
+        self,
+        full_path: str | os.PathLike,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        response = AttachmentResponse(full_path, status_code=status_code, stat_result=stat_result)
+        match = _CONTENT_ADDRESSED.match(os.path.basename(full_path))
+        if match:
+            response.headers["etag"] = f'"{match.group(1)}{match.group(2) or ""}"'
+        response.headers["cache-control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            metrics.incr("static.not_modified")
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,213 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import update
+
+from app.config import THUMBNAIL_QUEUE_SIZE, THUMBNAIL_SIZES, THUMBNAIL_WORKERS
+from app.database import AsyncSessionLocal
+from app.frames import Frame
+from app.metrics import metrics
+from database.models import Attachment, Message
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it no image thumbnails are made
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = os.path.join("uploads", "thumbnails")
+os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+
+IMAGE_TYPES = frozenset({"image/jpeg", "image/png", "image/gif", "image/webp"})
+VIDEO_TYPES = frozenset({"video/mp4", "video/webm"})
+
+
+def small_thumbnail(thumbnails: dict | None) -> str | None:
+    """URL of the smallest thumbnail, the variant history payloads carry."""
+    if not thumbnails:
+        return None
+    return thumbnails.get(str(THUMBNAIL_SIZES[0]))
+
+
+def thumbnail_frame(message_id: int, thumbnails: dict) -> Frame:
+    return Frame.from_payload(
+        {
+            "type": "thumbnail",
+            "message_id": message_id,
+            "thumbnail_url": small_thumbnail(thumbnails),
+            "thumbnails": thumbnails,
+        }
+    )
+
+
+def render_thumbnails(source: str, stem: str, sizes: tuple[int, ...]) -> dict[str, str]:
+    # Runs in a worker process. Blobs are content-addressed, so a thumbnail
+    # that already exists on disk is never rendered twice.
+    targets = {str(size): os.path.join(THUMBNAIL_DIR, f"{stem}_{size}.jpg") for size in sizes}
+    missing = [size for size in sizes if not os.path.exists(targets[str(size)])]
+    if missing:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            for size in missing:
+                thumbnail = image.copy()
+                thumbnail.thumbnail((size, size))
+                partial = f"{targets[str(size)]}.part"
+                thumbnail.save(partial, "JPEG", quality=80)
+                os.replace(partial, targets[str(size)])
+    return {key: f"/{path}" for key, path in targets.items()}
+
+
+class ThumbnailPipeline:
+    """Makes size-bucketed thumbnails (and a poster frame for videos) after an
+    attachment is stored, off the request path.
+
+    Jobs go through a bounded queue to a few worker tasks; image resizing runs
+    in a process pool and poster frames in an ffmpeg subprocess. Results are
+    recorded on the attachment and, for chat files, on the message.
+    """
+
+    def __init__(
+        self,
+        workers: int = THUMBNAIL_WORKERS,
+        queue_size: int = THUMBNAIL_QUEUE_SIZE,
+        sizes: tuple[int, ...] = THUMBNAIL_SIZES,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sizes = sizes
+        self.queue: asyncio.Queue | None = None
+        self._executor: ProcessPoolExecutor | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._ffmpeg = shutil.which("ffmpeg")
+
+    def start(self):
+        if self._tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def supports(self, content_type: str | None) -> bool:
+        if content_type in IMAGE_TYPES:
+            return Image is not None
+        if content_type in VIDEO_TYPES:
+            return Image is not None and self._ffmpeg is not None
+        return False
+
+    def submit(
+        self,
+        file_url: str,
+        content_type: str | None,
+        message_id: int | None = None,
+        on_ready=None,
+    ) -> bool:
+        """Queue thumbnails for a stored file; never waits.
+
+        ``on_ready`` is awaited with the thumbnail URLs once they exist.
+        """
+        if not self._tasks or not self.supports(content_type):
+            return False
+        try:
+            self.queue.put_nowait((file_url, content_type, message_id, on_ready))
+        except asyncio.QueueFull:
+            metrics.incr("thumbnails.dropped")
+            return False
+        metrics.set_gauge("thumbnails.queue_depth", self.queue.qsize())
+        return True
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._process(*job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to generate thumbnails for %s", job[0])
+                metrics.incr("thumbnails.errors")
+
+    async def _process(self, file_url: str, content_type: str, message_id, on_ready):
+        path = file_url.lstrip("/")
+        directory, filename = os.path.split(path)
+        stem = os.path.splitext(filename)[0]
+
+        source = path
+        thumbnails = {}
+        if content_type in VIDEO_TYPES:
+            source = await self._poster(path, stem)
+            if source is None:
+                return
+            thumbnails["poster"] = f"/{source}"
+
+        loop = asyncio.get_running_loop()
+        thumbnails.update(
+            await loop.run_in_executor(
+                self._executor, render_thumbnails, source, stem, self.sizes
+            )
+        )
+        metrics.incr("thumbnails.generated")
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Attachment)
+                .where(Attachment.directory == directory, Attachment.filename == filename)
+                .values(thumbnails=thumbnails)
+            )
+            if message_id is not None:
+                await db.execute(
+                    update(Message)
+                    .where(Message.id == message_id)
+                    .values(thumbnails=thumbnails)
+                )
+            await db.commit()
+
+        if on_ready is not None:
+            await on_ready(thumbnails)
+
+    async def _poster(self, path: str, stem: str) -> str | None:
+        poster = os.path.join(THUMBNAIL_DIR, f"{stem}_poster.jpg")
+        if os.path.exists(poster):
+            return poster
+        partial = f"{poster}.part"
+        # The thumbnail filter picks a representative frame near the start.
+        # The format is named because ffmpeg cannot infer it from ".part".
+        process = await asyncio.create_subprocess_exec(
+            self._ffmpeg,
+            "-loglevel", "error",
+            "-y",
+            "-i", path,
+            "-vf", "thumbnail",
+            "-frames:v", "1",
+            "-f", "image2",
+            "-c:v", "mjpeg",
+            partial,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        if await process.wait() != 0:
+            metrics.incr("thumbnails.errors")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(partial)
+            return None
+        os.replace(partial, poster)
+        return poster
+
+
+thumbnail_pipeline = ThumbnailPipeline()
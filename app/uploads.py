@@ -0,0 +1,276 @@
+import asyncio
+import base64
+import contextlib
+import hashlib
+import os
+import uuid
+from typing import NamedTuple
+
+from fastapi import HTTPException, UploadFile, WebSocket, WebSocketDisconnect
+
+from app.attachments import claim_blob, release_attachment
+from app.config import MAX_IMAGE_BYTES, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE
+from app.frames import Frame
+from app.metrics import metrics
+
+IMAGE_CONTENT_TYPES = frozenset({"image/jpeg", "image/png", "image/gif", "image/webp"})
+
+
+class UploadError(Exception):
+    pass
+
+
+class StoredUpload(NamedTuple):
+    url: str
+    mimetype: str | None
+    text: str | None
+
+
+def upload_extension(filename: str | None) -> str:
+    # Only the extension of a client-supplied name is kept
+    return os.path.splitext(os.path.basename(filename or ""))[1].lower()
+
+
+def _partial_path(directory: str) -> str:
+    return os.path.join(directory, f"{uuid.uuid4()}.part")
+
+
+def _write_chunk(f, digest, chunk: bytes):
+    digest.update(chunk)
+    f.write(chunk)
+
+
+def upload_error_frame(detail: str) -> Frame:
+    return Frame.from_payload({"type": "upload_error", "detail": detail})
+
+
+def _discard_partial(f, path: str):
+    f.close()
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+async def save_upload_file(
+    upload: UploadFile,
+    directory: str,
+    max_bytes: int = MAX_IMAGE_BYTES,
+    content_types: frozenset[str] | None = IMAGE_CONTENT_TYPES,
+) -> str:
+    """Stream a multipart upload into the attachment store under ``directory``
+    and return its stored filename.
+
+    The file is copied in UPLOAD_CHUNK_SIZE pieces to a ``.part`` file while
+    it is hashed; a blob that is already stored only gains a reference.
+    """
+    if content_types is not None and upload.content_type not in content_types:
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+
+    partial = _partial_path(directory)
+    f = await asyncio.to_thread(open, partial, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail="File is too large")
+            await asyncio.to_thread(_write_chunk, f, digest, chunk)
+        await asyncio.to_thread(f.close)
+        filename = await asyncio.to_thread(
+            claim_blob,
+            directory,
+            partial,
+            digest.hexdigest(),
+            upload_extension(upload.filename),
+            size,
+            upload.content_type,
+        )
+    except BaseException:
+        await asyncio.to_thread(_discard_partial, f, partial)
+        raise
+    metrics.observe("uploads.bytes", size)
+    return filename
+
+
+async def release_upload(directory: str, upload: StoredUpload):
+    """Give back the reference an upload took when no message ends up holding it."""
+    await release_attachment(directory, os.path.basename(upload.url))
+
+
+async def receive_message(websocket: WebSocket) -> str | bytes:
+    """Next text or binary frame from the socket."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return message["bytes"]
+    return message.get("text") or ""
+
+
+def _store_base64(directory: str, data: dict, max_bytes: int) -> str:
+    _, encoded = data["data"].split(",", 1)
+    if len(encoded) * 3 // 4 > max_bytes:
+        raise UploadError("File is too large")
+    blob = base64.b64decode(encoded)
+    partial = _partial_path(directory)
+    with open(partial, "wb") as f:
+        f.write(blob)
+    return claim_blob(
+        directory,
+        partial,
+        hashlib.sha256(blob).hexdigest(),
+        upload_extension(data["filename"]),
+        len(blob),
+        data["mimetype"],
+    )
+
+
+async def save_base64_upload(
+    directory: str, data: dict, max_bytes: int = MAX_UPLOAD_BYTES
+) -> StoredUpload:
+    """Legacy single-frame upload: a base64 data URL in ``data["data"]``."""
+    # Decoding and writing a large file would stall every socket on the loop
+    filename = await asyncio.to_thread(_store_base64, directory, data, max_bytes)
+    return StoredUpload(f"/{directory}/{filename}", data["mimetype"], data.get("text"))
+
+
+class ChunkedUpload:
+    """A file streamed to disk one binary WebSocket frame at a time.
+
+    Chunks go to a ``.part`` file and are hashed as they arrive; on commit the
+    file joins the attachment store, so a half-received upload is never served.
+    """
+
+    __slots__ = (
+        "directory",
+        "ext",
+        "mimetype",
+        "text",
+        "size",
+        "received",
+        "digest",
+        "partial",
+        "_file",
+    )
+
+    def __init__(
+        self,
+        directory: str,
+        filename: str,
+        mimetype: str | None,
+        text: str | None,
+        size: int | None,
+    ):
+        self.directory = directory
+        self.ext = upload_extension(filename)
+        self.mimetype = mimetype
+        self.text = text
+        self.size = size
+        self.received = 0
+        self.digest = hashlib.sha256()
+        self.partial = _partial_path(directory)
+        self._file = None
+
+    async def open(self):
+        self._file = await asyncio.to_thread(open, self.partial, "wb")
+
+    async def append(self, chunk: bytes, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.received += len(chunk)
+        if self.received > max_bytes or (
+            self.size is not None and self.received > self.size
+        ):
+            raise UploadError("File is too large")
+        await asyncio.to_thread(_write_chunk, self._file, self.digest, chunk)
+
+    async def commit(self) -> StoredUpload:
+        if self.size is not None and self.received != self.size:
+            raise UploadError("Upload is incomplete")
+        filename = await asyncio.to_thread(self._finish)
+        metrics.observe("uploads.bytes", self.received)
+        return StoredUpload(f"/{self.directory}/{filename}", self.mimetype, self.text)
+
+    def _finish(self) -> str:
+        self._file.close()
+        return claim_blob(
+            self.directory,
+            self.partial,
+            self.digest.hexdigest(),
+            self.ext,
+            self.received,
+            self.mimetype,
+        )
+
+    async def abort(self):
+        await asyncio.to_thread(_discard_partial, self._file, self.partial)
+
+
+class UploadSlot:
+    """The one chunked upload a socket may have in progress.
+
+    Protocol: an ``upload_begin`` frame (filename, mimetype, size, text),
+    then the file as binary frames, then ``upload_commit``; ``upload_abort``
+    discards it. Only one chunk is held in memory at a time.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current: ChunkedUpload | None = None
+
+    def _begin_fields(
+        self, data: dict
+    ) -> tuple[str, str | None, str | None, int | None]:
+        filename, size = data.get("filename"), data.get("size")
+        mimetype, text = data.get("mimetype"), data.get("text")
+        if not isinstance(filename, str):
+            raise UploadError("Missing file name")
+        if not isinstance(mimetype, str | None) or not isinstance(text, str | None):
+            raise UploadError("Invalid upload")
+        if size is not None:
+            try:
+                size = int(size)
+            except (TypeError, ValueError):
+                raise UploadError("Invalid file size") from None
+            if size < 0:
+                raise UploadError("Invalid file size")
+            if size > self.max_bytes:
+                raise UploadError("File is too large")
+        return filename, mimetype, text, size
+
+    async def begin(self, data: dict) -> Frame:
+        await self.abort()
+        try:
+            fields = self._begin_fields(data)
+        except UploadError as exc:
+            return upload_error_frame(str(exc))
+        upload = ChunkedUpload(self.directory, *fields)
+        await upload.open()
+        self.current = upload
+        return Frame.from_payload(
+            {"type": "upload_ready", "chunk_size": UPLOAD_CHUNK_SIZE}
+        )
+
+    async def append(self, chunk: bytes) -> Frame | None:
+        if self.current is None:
+            return upload_error_frame("No upload in progress")
+        try:
+            await self.current.append(chunk, self.max_bytes)
+        except UploadError as exc:
+            await self.abort()
+            return upload_error_frame(str(exc))
+        return None
+
+    async def commit(self) -> StoredUpload:
+        upload, self.current = self.current, None
+        if upload is None:
+            raise UploadError("No upload in progress")
+        try:
+            return await upload.commit()
+        except Exception:
+            await upload.abort()
+            raise
+
+    async def abort(self):
+        upload, self.current = self.current, None
+        if upload is not None:
+            await upload.abort()
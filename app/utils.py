@@ -1,21 +1,76 @@
+import hashlib
+from datetime import UTC, datetime, timedelta
+
 import jwt
 from fastapi import Depends, Header, HTTPException, Query
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-
-from app.config import ALGORITHM, SECRET_KEY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app.cache import TTLCache
+from app.config import (
+    ALGORITHM,
+    ROOM_TICKET_EXPIRE_MINUTES,
+    SECRET_KEY,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+)
 from app.database import get_db
-from database.models import RoomMembers, User
+from app.membership import membership
+from app.password_pool import bcrypt_hash, bcrypt_verify, password_pool
+from database.models import Chatroom, User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# user id -> detached User snapshot
+user_cache = TTLCache("users", maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_pool.run_sync(bcrypt_hash, password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_pool.run_sync(bcrypt_verify, plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_pool.run(bcrypt_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run(bcrypt_verify, plain_password, hashed_password)
+
+
+def _snapshot(user: User) -> User:
+    copy = User(
+        **{column.key: getattr(user, column.key) for column in User.__table__.columns}
+    )
+    make_transient_to_detached(copy)
+    return copy
+
+
+def get_cached_user(user_id: int, db: Session) -> User | None:
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        # load=False attaches a copy to this session without a SELECT,
+        # so routes can still modify and commit it
+        return db.merge(cached, load=False)
+    user = db.get(User, user_id)
+    if user:
+        user_cache.set(user_id, _snapshot(user))
+    return user
+
+
+async def get_cached_user_async(user_id: int, db: AsyncSession) -> User | None:
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return await db.merge(cached, load=False)
+    user = await db.get(User, user_id)
+    if user:
+        user_cache.set(user_id, _snapshot(user))
+    return user
+
+
+def invalidate_user(user_id: int):
+    user_cache.invalidate(user_id)
 
 
 def get_current_user(
@@ -27,10 +82,8 @@ def get_current_user(
             raise HTTPException(status_code=401, detail="Invalid token scheme")
 
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(payload)
-        user_id = payload.get("sub")
-        user = db.query(User).filter_by(id=user_id).first()
-        print(user)
+        user_id = int(payload.get("sub"))
+        user = get_cached_user(user_id, db)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return user
@@ -40,16 +93,19 @@ def get_current_user(
         raise HTTPException(status_code=401, detail="Invalid or missing token")
 
 
+def user_id_from_token(obtained_token: str) -> int:
+    if obtained_token.lower().startswith("bearer "):
+        token = obtained_token[7:]  # strip first 7 chars (bearer + space)
+    else:
+        token = obtained_token
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    return int(payload.get("sub"))
+
+
 def verify_token(obtained_token: str = Query(...), db: Session = Depends(get_db)):
     try:
-        if obtained_token.lower().startswith("bearer "):
-            token = obtained_token[7:]  # strip first 7 chars (bearer + space)
-        else:
-            token = obtained_token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = int(payload.get("sub"))
-        print(f"user_id from token: {user_id}")
-        user = db.query(User).filter_by(id=user_id).first()
+        user_id = user_id_from_token(obtained_token)
+        user = get_cached_user(user_id, db)
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -60,11 +116,70 @@ def verify_token(obtained_token: str = Query(...), db: Session = Depends(get_db)
         raise HTTPException(status_code=401, detail="Invalid or missing token")
 
 
+async def verify_token_async(obtained_token: str, db: AsyncSession):
+    try:
+        user_id = user_id_from_token(obtained_token)
+        user = await get_cached_user_async(user_id, db)
+
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return user
+    except jwt.ExpiredSignatureError as exc:
+        raise HTTPException(status_code=401, detail="Token has expired") from exc
+    except Exception as exc:
+        raise HTTPException(status_code=401, detail="Invalid or missing token") from exc
+
+
+ROOM_TICKET_AUDIENCE = "room"
+
+
+def _room_password_fingerprint(room: Chatroom) -> str:
+    # Changing the room password invalidates tickets issued for the old one
+    return hashlib.sha256((room.password or "").encode()).hexdigest()[:16]
+
+
+def create_room_ticket(user_id: int, room: Chatroom) -> str:
+    payload = {
+        "sub": str(user_id),
+        "room": room.id,
+        "pwd": _room_password_fingerprint(room),
+        "aud": ROOM_TICKET_AUDIENCE,
+        "exp": datetime.now(UTC) + timedelta(minutes=ROOM_TICKET_EXPIRE_MINUTES),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def verify_room_ticket(ticket: str | None, user_id: int, room: Chatroom) -> bool:
+    if not ticket:
+        return False
+    try:
+        payload = jwt.decode(
+            ticket, SECRET_KEY, algorithms=[ALGORITHM], audience=ROOM_TICKET_AUDIENCE
+        )
+    except jwt.PyJWTError:
+        return False
+    return (
+        payload.get("sub") == str(user_id)
+        and payload.get("room") == room.id
+        and payload.get("pwd") == _room_password_fingerprint(room)
+    )
+
+
 def check_user_inroom(userid: int, roomid: int, db: Session):
-    membership = db.query(RoomMembers).filter_by(user_id=userid, room_id=roomid).first()
-    return membership is not None
+    return userid in membership.members(roomid, db)
+
+
+def check_user_is_admin(userid: int, roomid: int, db: Session):
+    return membership.members(roomid, db).get(userid, False)
 
 
 def verify_user(id: int, db: Session):
-    userexist = db.query(User).filter_by(id=id).first()
-    return userexist is not None
+    return get_cached_user(id, db) is not None
+
+
+async def check_user_inroom_async(userid: int, roomid: int, db: AsyncSession):
+    return userid in await membership.members_async(roomid, db)
+
+
+async def verify_user_async(id: int, db: AsyncSession):
+    return await get_cached_user_async(id, db) is not None
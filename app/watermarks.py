@@ -0,0 +1,179 @@
+from collections import Counter
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.conversations import dialect_insert
+from database.models import Chatroom, Message, ReadWatermark
+
+
+def upsert_watermarks(dialect: str, values: list[dict]):
+    """Insert or advance read watermarks; a watermark never moves back."""
+    stmt = dialect_insert(dialect, ReadWatermark).values(values)
+    table = ReadWatermark.__table__
+    newer = stmt.excluded.last_read_message_id > table.c.last_read_message_id
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "kind", "target_id"],
+        set_={
+            "last_read_message_id": case(
+                (newer, stmt.excluded.last_read_message_id),
+                else_=table.c.last_read_message_id,
+            ),
+            "read_count": case(
+                (newer, stmt.excluded.read_count), else_=table.c.read_count
+            ),
+            "updated_at": func.now(),
+        },
+    ).returning(ReadWatermark.read_count)
+
+
+async def reserve_room_positions(db: AsyncSession, rows: list[dict]) -> list[int | None]:
+    """Number every room message of a batch within its room (1, 2, ...).
+
+    Raising a room's message_count locks its row until the batch commits,
+    so the positions handed out are the room's next ones whatever other
+    writers are doing. DMs get ``None``.
+    """
+    counts = Counter(row["room_id"] for row in rows if row["room_id"] is not None)
+    next_position = {}
+    for room_id in sorted(counts):
+        message_count = (
+            await db.execute(
+                update(Chatroom)
+                .where(Chatroom.id == room_id)
+                .values(message_count=Chatroom.message_count + counts[room_id])
+                .returning(Chatroom.message_count)
+            )
+        ).scalar_one()
+        next_position[room_id] = message_count - counts[room_id] + 1
+
+    positions = []
+    for row in rows:
+        room_id = row["room_id"]
+        if room_id is None:
+            positions.append(None)
+        else:
+            positions.append(next_position[room_id])
+            next_position[room_id] += 1
+    return positions
+
+
+async def record_room_messages(
+    db: AsyncSession, rows: list[dict], stored: list, positions: list[int | None]
+):
+    """Advance the newest message of every room in a batch of new messages.
+
+    Each sender has read the room up to their own latest message, so their
+    watermark moves with it and they never see their own messages as unread.
+    """
+    rooms = {}
+    for row, (message_id, _), position in zip(rows, stored, positions, strict=True):
+        if position is not None:
+            rooms.setdefault(row["room_id"], []).append(
+                (message_id, row["sender_id"], position)
+            )
+
+    watermarks = []
+    for room_id in sorted(rooms):
+        messages = sorted(rooms[room_id])
+        newest = messages[-1][0]
+        await db.execute(
+            update(Chatroom)
+            .where(Chatroom.id == room_id)
+            .values(
+                last_message_id=case(
+                    (Chatroom.last_message_id > newest, Chatroom.last_message_id),
+                    else_=newest,
+                )
+            )
+        )
+
+        senders = {}
+        for message_id, sender_id, position in messages:
+            senders[sender_id] = (message_id, position)
+        watermarks.extend(
+            {
+                "user_id": sender_id,
+                "kind": "room",
+                "target_id": room_id,
+                "last_read_message_id": message_id,
+                "read_count": position,
+            }
+            for sender_id, (message_id, position) in sorted(senders.items())
+        )
+
+    if watermarks:
+        await db.execute(upsert_watermarks(db.bind.dialect.name, watermarks))
+
+
+def _room_position_statement(room_id: int, message_id: int | None):
+    # The room's counters plus how many of its messages a reader who has seen
+    # up to message_id has read: the position of the newest room message at
+    # or before it, one probe on the (room_id, id) index.
+    read_count = Chatroom.message_count
+    if message_id is not None:
+        position = (
+            select(Message.room_seq)
+            .where(Message.room_id == room_id, Message.id <= message_id)
+            .order_by(Message.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        read_count = func.coalesce(position, 0)
+    return select(
+        Chatroom.message_count, Chatroom.last_message_id, read_count
+    ).where(Chatroom.id == room_id)
+
+
+def _room_watermark(user_id: int, room_id: int, message_id: int | None, row) -> dict:
+    _, last_message_id, read_count = row
+    if message_id is None or (last_message_id is not None and message_id > last_message_id):
+        message_id = last_message_id
+    return {
+        "user_id": user_id,
+        "kind": "room",
+        "target_id": room_id,
+        "last_read_message_id": message_id or 0,
+        "read_count": read_count,
+    }
+
+
+def mark_room_read(
+    db: Session, user_id: int, room_id: int, message_id: int | None = None
+) -> int:
+    """Move the user's watermark for a room up to ``message_id`` (default:
+    the newest message) and return how many messages are left unread."""
+    row = db.execute(_room_position_statement(room_id, message_id)).one()
+    read_count = db.execute(
+        upsert_watermarks(
+            db.bind.dialect.name, [_room_watermark(user_id, room_id, message_id, row)]
+        )
+    ).scalar()
+    db.commit()
+    return max(row.message_count - read_count, 0)
+
+
+async def mark_room_read_async(
+    db: AsyncSession, user_id: int, room_id: int, message_id: int | None = None
+) -> int:
+    row = (await db.execute(_room_position_statement(room_id, message_id))).one()
+    read_count = (
+        await db.execute(
+            upsert_watermarks(
+                db.bind.dialect.name, [_room_watermark(user_id, room_id, message_id, row)]
+            )
+        )
+    ).scalar()
+    await db.commit()
+    return max(row.message_count - read_count, 0)
+
+
+def forget_room_watermark(db: Session, user_id: int, room_id: int):
+    db.execute(
+        delete(ReadWatermark).where(
+            ReadWatermark.user_id == user_id,
+            ReadWatermark.kind == "room",
+            ReadWatermark.target_id == room_id,
+        )
+    )
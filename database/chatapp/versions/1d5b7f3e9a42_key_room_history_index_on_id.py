@@ -0,0 +1,58 @@
+"""key room history index on id
+
+Revision ID: 1d5b7f3e9a42
+Revises: 4a9f0e2c6d81
+Create Date: 2026-10-19 10:04:18.552031
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "1d5b7f3e9a42"
+down_revision: str | Sequence[str] | None = "4a9f0e2c6d81"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Room history now pages on the message id alone; build the new index
+    # before dropping the old one so history reads never lose their index.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_room_history_id",
+            "messages",
+            ["room_id", "id"],
+            postgresql_where=sa.text("room_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_room_history",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+    op.execute("ALTER INDEX ix_messages_room_history_id RENAME TO ix_messages_room_history")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_room_history_sent_at",
+            "messages",
+            ["room_id", "sent_at", "id"],
+            postgresql_where=sa.text("room_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_room_history",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+    op.execute(
+        "ALTER INDEX ix_messages_room_history_sent_at RENAME TO ix_messages_room_history"
+    )
@@ -0,0 +1,131 @@
+"""add conversation summary
+
+Revision ID: 3f8d2a6c7e15
+Revises: 9e7a4c1d2b60
+Create Date: 2026-10-18 18:05:12.304117
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3f8d2a6c7e15"
+down_revision: str | Sequence[str] | None = "9e7a4c1d2b60"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "conversation_summary",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("target_id", sa.Integer(), nullable=False),
+        sa.Column("last_message_id", sa.Integer(), nullable=False),
+        sa.Column("last_sent_at", sa.DateTime(), nullable=False),
+        sa.Column("last_content", sa.Text(), nullable=False),
+        sa.Column("last_file_url", sa.String(), nullable=True),
+        sa.Column("last_file_type", sa.String(), nullable=True),
+        sa.Column("unread_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.ForeignKeyConstraint(["last_message_id"], ["messages.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "user_id", "kind", "target_id", name="uq_conversation_summary_user_kind_target"
+        ),
+    )
+    op.create_index(
+        "ix_conversation_summary_user_recent",
+        "conversation_summary",
+        ["user_id", "last_sent_at", "last_message_id"],
+    )
+
+    # Every DM seen from both ends: the sender's copy is never unread, the
+    # receiver's is until it has been read.
+    op.execute(
+        """
+        WITH dm AS (
+            SELECT sender_id AS user_id, receiver_id AS target_id, id, sent_at,
+                   content, file_url, file_type, 0 AS unread
+            FROM messages
+            WHERE receiver_id IS NOT NULL
+            UNION ALL
+            SELECT receiver_id, sender_id, id, sent_at, content, file_url, file_type,
+                   CASE WHEN status = 'read' THEN 0 ELSE 1 END
+            FROM messages
+            WHERE receiver_id IS NOT NULL AND receiver_id <> sender_id
+        ),
+        latest AS (
+            SELECT DISTINCT ON (user_id, target_id) *
+            FROM dm
+            ORDER BY user_id, target_id, id DESC
+        ),
+        unread AS (
+            SELECT user_id, target_id, sum(unread) AS unread_count
+            FROM dm
+            GROUP BY user_id, target_id
+        )
+        INSERT INTO conversation_summary (
+            user_id, kind, target_id, last_message_id, last_sent_at,
+            last_content, last_file_url, last_file_type, unread_count
+        )
+        SELECT latest.user_id, 'personal', latest.target_id, latest.id, latest.sent_at,
+               left(latest.content, 200), latest.file_url, latest.file_type,
+               unread.unread_count
+        FROM latest
+        JOIN unread USING (user_id, target_id)
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO conversation_summary (
+            user_id, kind, target_id, last_message_id, last_sent_at,
+            last_content, last_file_url, last_file_type, unread_count
+        )
+        SELECT DISTINCT ON (sender_id, room_id)
+               sender_id, 'group', room_id, id, sent_at,
+               left(content, 200), file_url, file_type, 0
+        FROM messages
+        WHERE room_id IS NOT NULL
+        ORDER BY sender_id, room_id, id DESC
+        """
+    )
+
+    # Only the old /home queries used these
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_messages_sender_room",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_sender_status",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_sender_status",
+            "messages",
+            ["sender_id", "status", "receiver_id", "sent_at"],
+            postgresql_where=sa.text("receiver_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_messages_sender_room",
+            "messages",
+            ["sender_id", "room_id", "sent_at"],
+            postgresql_where=sa.text("room_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+    op.drop_index("ix_conversation_summary_user_recent", table_name="conversation_summary")
+    op.drop_table("conversation_summary")
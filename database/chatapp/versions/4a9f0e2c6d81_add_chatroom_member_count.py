@@ -0,0 +1,43 @@
+"""add chatroom member count
+
+Revision ID: 4a9f0e2c6d81
+Revises: e6a3b8d0f217
+Create Date: 2026-10-18 21:12:50.640218
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4a9f0e2c6d81"
+down_revision: str | Sequence[str] | None = "e6a3b8d0f217"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "chatroom",
+        sa.Column("member_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.execute(
+        """
+        UPDATE chatroom
+        SET member_count = counts.member_count
+        FROM (
+            SELECT room_id, count(*) AS member_count
+            FROM room_members
+            GROUP BY room_id
+        ) AS counts
+        WHERE chatroom.id = counts.room_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("chatroom", "member_count")
@@ -0,0 +1,45 @@
+"""add attachments table
+
+Revision ID: 5d2b8e91c3f4
+Revises: c4e1f0a7b2d9
+Create Date: 2026-10-18 14:05:12.402117
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5d2b8e91c3f4"
+down_revision: str | Sequence[str] | None = "c4e1f0a7b2d9"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "attachments",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("directory", sa.String(), nullable=False),
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("filename", sa.String(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("content_type", sa.String(), nullable=True),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "directory", "sha256", name="uq_attachments_directory_sha256"
+        ),
+        sa.UniqueConstraint(
+            "directory", "filename", name="uq_attachments_directory_filename"
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("attachments")
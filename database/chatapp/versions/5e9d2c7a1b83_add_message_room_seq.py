@@ -0,0 +1,68 @@
+"""add message room seq
+
+Revision ID: 5e9d2c7a1b83
+Revises: 8c3e6a0d2f57
+Create Date: 2026-10-19 11:20:07.381925
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5e9d2c7a1b83"
+down_revision: str | Sequence[str] | None = "8c3e6a0d2f57"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("messages", sa.Column("room_seq", sa.Integer(), nullable=True))
+    op.execute(
+        """
+        UPDATE messages
+        SET room_seq = numbered.room_seq
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY room_id ORDER BY id) AS room_seq
+            FROM messages
+            WHERE room_id IS NOT NULL
+        ) AS numbered
+        WHERE messages.id = numbered.id
+        """
+    )
+    op.execute(
+        """
+        UPDATE chatroom
+        SET message_count = coalesce(
+            (SELECT max(room_seq) FROM messages WHERE messages.room_id = chatroom.id),
+            0
+        )
+        """
+    )
+    # Read counts recorded so far could have drifted; take them from the
+    # position of the last message each reader has seen.
+    op.execute(
+        """
+        UPDATE read_watermarks
+        SET read_count = coalesce(
+            (
+                SELECT room_seq
+                FROM messages
+                WHERE messages.room_id = read_watermarks.target_id
+                  AND messages.id <= read_watermarks.last_read_message_id
+                ORDER BY messages.id DESC
+                LIMIT 1
+            ),
+            0
+        )
+        WHERE kind = 'room'
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("messages", "room_seq")
@@ -0,0 +1,87 @@
+"""add read watermarks
+
+Revision ID: 7b1e9c4f3a28
+Revises: 3f8d2a6c7e15
+Create Date: 2026-10-18 19:20:44.918305
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7b1e9c4f3a28"
+down_revision: str | Sequence[str] | None = "3f8d2a6c7e15"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "chatroom",
+        sa.Column("message_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.add_column("chatroom", sa.Column("last_message_id", sa.Integer(), nullable=True))
+    op.create_table(
+        "read_watermarks",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("target_id", sa.Integer(), nullable=False),
+        sa.Column("last_read_message_id", sa.Integer(), nullable=False),
+        sa.Column("read_count", sa.Integer(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "user_id", "kind", "target_id", name="uq_read_watermarks_user_kind_target"
+        ),
+    )
+
+    op.execute(
+        """
+        UPDATE chatroom
+        SET message_count = counts.message_count,
+            last_message_id = counts.last_message_id
+        FROM (
+            SELECT room_id, count(*) AS message_count, max(id) AS last_message_id
+            FROM messages
+            WHERE room_id IS NOT NULL
+            GROUP BY room_id
+        ) AS counts
+        WHERE chatroom.id = counts.room_id
+        """
+    )
+    # Rooms had no read tracking: start every member with nothing unread
+    op.execute(
+        """
+        INSERT INTO read_watermarks (
+            user_id, kind, target_id, last_read_message_id, read_count, updated_at
+        )
+        SELECT room_members.user_id, 'room', chatroom.id,
+               coalesce(chatroom.last_message_id, 0), chatroom.message_count, now()
+        FROM room_members
+        JOIN chatroom ON chatroom.id = room_members.room_id
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO read_watermarks (
+            user_id, kind, target_id, last_read_message_id, read_count, updated_at
+        )
+        SELECT receiver_id, 'personal', sender_id, max(id), NULL, now()
+        FROM messages
+        WHERE receiver_id IS NOT NULL AND status = 'read'
+        GROUP BY receiver_id, sender_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("read_watermarks")
+    op.drop_column("chatroom", "last_message_id")
+    op.drop_column("chatroom", "message_count")
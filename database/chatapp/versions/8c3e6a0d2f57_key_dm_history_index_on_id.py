@@ -0,0 +1,58 @@
+"""key dm history index on id
+
+Revision ID: 8c3e6a0d2f57
+Revises: 1d5b7f3e9a42
+Create Date: 2026-10-19 10:31:52.907614
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8c3e6a0d2f57"
+down_revision: str | Sequence[str] | None = "1d5b7f3e9a42"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # DM history now pages on the message id alone; build the new index
+    # before dropping the old one so history reads never lose their index.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_dm_history_id",
+            "messages",
+            ["sender_id", "receiver_id", "id"],
+            postgresql_where=sa.text("receiver_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_dm_history",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+    op.execute("ALTER INDEX ix_messages_dm_history_id RENAME TO ix_messages_dm_history")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_dm_history_sent_at",
+            "messages",
+            ["sender_id", "receiver_id", "sent_at", "id"],
+            postgresql_where=sa.text("receiver_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_dm_history",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+    op.execute(
+        "ALTER INDEX ix_messages_dm_history_sent_at RENAME TO ix_messages_dm_history"
+    )
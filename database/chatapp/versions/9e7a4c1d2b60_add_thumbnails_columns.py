@@ -0,0 +1,30 @@
+"""add thumbnails columns
+
+Revision ID: 9e7a4c1d2b60
+Revises: 5d2b8e91c3f4
+Create Date: 2026-10-18 16:40:27.551903
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9e7a4c1d2b60"
+down_revision: str | Sequence[str] | None = "5d2b8e91c3f4"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("messages", sa.Column("thumbnails", sa.JSON(), nullable=True))
+    op.add_column("attachments", sa.Column("thumbnails", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("attachments", "thumbnails")
+    op.drop_column("messages", "thumbnails")
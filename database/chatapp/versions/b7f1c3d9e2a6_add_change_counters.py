@@ -0,0 +1,33 @@
+"""add change counters
+
+Revision ID: b7f1c3d9e2a6
+Revises: 5e9d2c7a1b83
+Create Date: 2026-10-19 12:02:44.190573
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b7f1c3d9e2a6"
+down_revision: str | Sequence[str] | None = "5e9d2c7a1b83"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "change_counters",
+        sa.Column("name", sa.String(length=32), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("change_counters")
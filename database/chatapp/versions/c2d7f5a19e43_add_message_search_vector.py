@@ -0,0 +1,39 @@
+"""add message search vector
+
+Revision ID: c2d7f5a19e43
+Revises: 7b1e9c4f3a28
+Create Date: 2026-10-18 20:02:31.476850
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c2d7f5a19e43"
+down_revision: str | Sequence[str] | None = "7b1e9c4f3a28"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Adding a stored generated column rewrites the table once
+    op.execute(
+        "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED"
+    )
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_messages_search_vector "
+            "ON messages USING gin (search_vector)"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_messages_search_vector")
+    op.drop_column("messages", "search_vector")
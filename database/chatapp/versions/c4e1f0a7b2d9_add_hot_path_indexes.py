@@ -0,0 +1,123 @@
+"""add hot path indexes
+
+Revision ID: c4e1f0a7b2d9
+Revises: 8379cc4d7602
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c4e1f0a7b2d9"
+down_revision: str | Sequence[str] | None = "8379cc4d7602"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The unique index below cannot be built while duplicate memberships exist;
+    # keep the oldest row for every (user_id, room_id) pair.
+    op.execute(
+        """
+        DELETE FROM room_members a
+        USING room_members b
+        WHERE a.user_id = b.user_id
+          AND a.room_id = b.room_id
+          AND a.id > b.id
+        """
+    )
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_room_history",
+            "messages",
+            ["room_id", "sent_at", "id"],
+            postgresql_where=sa.text("room_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_messages_dm_history",
+            "messages",
+            ["sender_id", "receiver_id", "sent_at", "id"],
+            postgresql_where=sa.text("receiver_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_messages_sender_status",
+            "messages",
+            ["sender_id", "status", "receiver_id", "sent_at"],
+            postgresql_where=sa.text("receiver_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_messages_sender_room",
+            "messages",
+            ["sender_id", "room_id", "sent_at"],
+            postgresql_where=sa.text("room_id IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "uq_room_members_user_room",
+            "room_members",
+            ["user_id", "room_id"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_room_members_room_user",
+            "room_members",
+            ["room_id", "user_id"],
+            postgresql_concurrently=True,
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_users_username_lower_pattern "
+            "ON users (lower(username) text_pattern_ops)"
+        )
+
+    # Promoting an existing unique index to a constraint only takes a brief lock.
+    op.execute(
+        "ALTER TABLE room_members ADD CONSTRAINT uq_room_members_user_room "
+        "UNIQUE USING INDEX uq_room_members_user_room"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("uq_room_members_user_room", "room_members", type_="unique")
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_users_username_lower_pattern",
+            table_name="users",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_room_members_room_user",
+            table_name="room_members",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_sender_room",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_sender_status",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_dm_history",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_messages_room_history",
+            table_name="messages",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,39 @@
+"""version rooms individually
+
+Revision ID: d4a8e6c1f5b2
+Revises: b7f1c3d9e2a6
+Create Date: 2026-10-19 15:41:08.662914
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d4a8e6c1f5b2"
+down_revision: str | Sequence[str] | None = "b7f1c3d9e2a6"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "chatroom",
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+    )
+    # The single "rooms" counter every room change used to bump
+    op.drop_table("change_counters")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table(
+        "change_counters",
+        sa.Column("name", sa.String(length=32), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.drop_column("chatroom", "version")
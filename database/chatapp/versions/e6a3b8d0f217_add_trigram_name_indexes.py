@@ -0,0 +1,46 @@
+"""add trigram name indexes
+
+Revision ID: e6a3b8d0f217
+Revises: c2d7f5a19e43
+Create Date: 2026-10-18 20:41:09.127354
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e6a3b8d0f217"
+down_revision: str | Sequence[str] | None = "c2d7f5a19e43"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_users_username_trgm "
+            "ON users USING gin (lower(username) gin_trgm_ops)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_chatroom_roomname_trgm "
+            "ON chatroom USING gin (lower(roomname) gin_trgm_ops)"
+        )
+        # Username search is a substring match now, served by the trigram
+        # index; the prefix-only pattern index would just slow down writes.
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_users_username_lower_pattern")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_users_username_lower_pattern "
+            "ON users (lower(username) text_pattern_ops)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_chatroom_roomname_trgm")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_users_username_trgm")
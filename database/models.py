@@ -1,25 +1,56 @@
 import enum
 
 from sqlalchemy import (
+    DDL,
+    JSON,
     Boolean,
     Column,
+    Computed,
     DateTime,
+    Enum,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
-    func, Enum,
+    UniqueConstraint,
+    event,
+    func,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.schema import CreateColumn
 
 Base = declarative_base()
 
+# Text search configuration of messages.search_vector; changing it needs a
+# migration that rebuilds the column
+SEARCH_CONFIG = "simple"
+
+
+@compiles(CreateColumn, "sqlite")
+def _skip_postgresql_only_columns(element, compiler, **kw):
+    # Columns such as messages.search_vector only exist on PostgreSQL
+    if element.element.info.get("postgresql_only"):
+        return None
+    return compiler.visit_create_column(element, **kw)
+
+
+# The trigram indexes on users and chatroom need pg_trgm
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 
 class MessageStatus(str, enum.Enum):
     sent = "sent"
     delivered = "delivered"
     read = "read"
 
+
 class User(Base):
     __tablename__ = "users"
 
@@ -33,6 +64,16 @@ class User(Base):
     profile_image = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        # Substring and fuzzy username search (pg_trgm)
+        Index(
+            "ix_users_username_trgm",
+            func.lower(username).label("username_trgm"),
+            postgresql_using="gin",
+            postgresql_ops={"username_trgm": "gin_trgm_ops"},
+        ),
+    )
+
     # One-to-many: User can create many chatrooms
     chatrooms = relationship("Chatroom", back_populates="creator")
     # Many-to-many: User is member of many chatrooms
@@ -57,6 +98,25 @@ class Chatroom(Base):
     created_at = Column(DateTime, default=func.now())
     password = Column(String, nullable=True)
     image = Column(String, nullable=True)
+    # Kept by the message writer; unread counts are message_count minus a
+    # member's read watermark
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_id = Column(Integer, nullable=True)
+    # Kept by the routes that add and remove members
+    member_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Moved on by every change to what /getgroups shows for the room, so a
+    # page's ETag is known from its rooms' versions alone
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # Substring and fuzzy room name search (pg_trgm)
+        Index(
+            "ix_chatroom_roomname_trgm",
+            func.lower(roomname).label("roomname_trgm"),
+            postgresql_using="gin",
+            postgresql_ops={"roomname_trgm": "gin_trgm_ops"},
+        ),
+    )
 
     # Creator of the room
     creator = relationship("User", back_populates="chatrooms")
@@ -75,6 +135,11 @@ class RoomMembers(Base):
     is_admin = Column(Boolean, default=False)
     joined_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        UniqueConstraint("user_id", "room_id", name="uq_room_members_user_room"),
+        Index("ix_room_members_room_user", "room_id", "user_id"),
+    )
+
     # Relationships
     user = relationship("User", back_populates="member_of")
     chatroom = relationship("Chatroom", back_populates="members")
@@ -92,6 +157,38 @@ class Message(Base):
     status = Column(Enum(MessageStatus), default=MessageStatus.sent)
     file_url = Column(String, nullable=True)
     file_type = Column(String, nullable=True)
+    # Thumbnail URLs by size, plus "poster" for videos
+    thumbnails = Column(JSON, nullable=True)
+    # 1, 2, ... within the room, so read counts never have to count messages
+    room_seq = Column(Integer, nullable=True)
+    # Full-text search, PostgreSQL only. Left out of the mapper so the ORM
+    # never selects or returns it; search queries use the column directly.
+    search_vector = Column(
+        TSVECTOR,
+        Computed(
+            f"to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))", persisted=True
+        ),
+        info={"postgresql_only": True},
+    )
+
+    __table_args__ = (
+        # Room history, newest page first
+        Index(
+            "ix_messages_room_history",
+            room_id,
+            id,
+            postgresql_where=room_id.isnot(None),
+        ),
+        # DM history, one range per direction of the conversation
+        Index(
+            "ix_messages_dm_history",
+            sender_id,
+            receiver_id,
+            id,
+            postgresql_where=receiver_id.isnot(None),
+        ),
+    )
+    __mapper_args__ = {"exclude_properties": ["search_vector"]}
 
     # Relationships
     sender = relationship(
@@ -101,3 +198,122 @@ class Message(Base):
         "User", back_populates="messages_received", foreign_keys=[receiver_id]
     )
     room = relationship("Chatroom", back_populates="messages")
+
+
+# Message search indexes. PostgreSQL gets a GIN index on search_vector; SQLite,
+# used for local runs, gets an FTS5 table over content kept in sync by triggers.
+for statement, dialect in (
+    (
+        "CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)",
+        "postgresql",
+    ),
+    (
+        "CREATE VIRTUAL TABLE messages_fts USING fts5("
+        "content, content='messages', content_rowid='id')",
+        "sqlite",
+    ),
+    (
+        "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+        "sqlite",
+    ),
+    (
+        "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); END",
+        "sqlite",
+    ),
+    (
+        "CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END",
+        "sqlite",
+    ),
+):
+    event.listen(
+        Message.__table__, "after_create", DDL(statement).execute_if(dialect=dialect)
+    )
+
+
+class Attachment(Base):
+    """One stored file, shared by every message, room or user that uploaded
+    the same bytes into the same upload directory."""
+
+    __tablename__ = "attachments"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    directory = Column(String, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    filename = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    content_type = Column(String, nullable=True)
+    # Messages, rooms and users currently pointing at this file
+    ref_count = Column(Integer, nullable=False, default=1)
+    thumbnails = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("directory", "sha256", name="uq_attachments_directory_sha256"),
+        UniqueConstraint(
+            "directory", "filename", name="uq_attachments_directory_filename"
+        ),
+    )
+
+
+class ConversationSummary(Base):
+    """One entry of a user's /home list, kept current by the message writer
+    so the list never has to be rebuilt from the messages table."""
+
+    __tablename__ = "conversation_summary"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # "personal" (target is the other user) or "group" (target is the room)
+    kind = Column(String(16), nullable=False)
+    target_id = Column(Integer, nullable=False)
+    last_message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
+    last_sent_at = Column(DateTime, nullable=False)
+    last_content = Column(Text, nullable=False)
+    last_file_url = Column(String, nullable=True)
+    last_file_type = Column(String, nullable=True)
+    # DMs from the other user that this user has not read yet
+    unread_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id",
+            "kind",
+            "target_id",
+            name="uq_conversation_summary_user_kind_target",
+        ),
+        # /home, newest conversation first
+        Index(
+            "ix_conversation_summary_user_recent",
+            user_id,
+            last_sent_at,
+            last_message_id,
+        ),
+    )
+
+
+class ReadWatermark(Base):
+    """How far a user has read a room ("room") or a DM conversation
+    ("personal", target is the other user). Only ever moves forward."""
+
+    __tablename__ = "read_watermarks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String(16), nullable=False)
+    target_id = Column(Integer, nullable=False)
+    last_read_message_id = Column(Integer, nullable=False)
+    # Rooms only: the room's message_count up to and including that message
+    read_count = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "kind", "target_id", name="uq_read_watermarks_user_kind_target"
+        ),
+    )
@@ -0,0 +1,70 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+# Settings are read at import time, so they must be in place before the app.
+# The app creates its upload folders under the working directory.
+_db_dir = tempfile.mkdtemp()
+os.chdir(_db_dir)
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/test.db"
+os.environ["SECRET_KEY"] = "test-secret-key-for-the-suite-only"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.config import ALGORITHM, SECRET_KEY  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from database.models import Chatroom, RoomMembers, User  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def make_user(db):
+    def make(username: str) -> User:
+        user = User(
+            username=username,
+            first_name=username.title(),
+            last_name="Test",
+            email=f"{username}@example.com",
+            password="not-a-hash",
+        )
+        db.add(user)
+        db.commit()
+        return user
+
+    return make
+
+
+@pytest.fixture
+def make_room(db):
+    def make(roomname: str, *members: User) -> Chatroom:
+        room = Chatroom(roomname=roomname, created_by=members[0].id, is_private=False)
+        db.add(room)
+        db.commit()
+        db.add_all(RoomMembers(user_id=member.id, room_id=room.id) for member in members)
+        db.commit()
+        return room
+
+    return make
+
+
+def auth_header(user: User) -> dict:
+    payload = {"sub": str(user.id), "exp": datetime.utcnow() + timedelta(hours=1)}
+    token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
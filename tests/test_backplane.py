@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+from app.backplane import PG_NOTIFY_MAX_PAYLOAD, PostgresBackplane, split_utf8
+from app.frames import Frame
+
+
+class FakeConnection:
+    def __init__(self, notifications: list[str]):
+        self.notifications = notifications
+
+    def transaction(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, query: str, pg_channel: str, payload: str):
+        assert len(payload.encode()) <= PG_NOTIFY_MAX_PAYLOAD
+        self.notifications.append(payload)
+
+
+class FakePool(FakeConnection):
+    def acquire(self):
+        return self
+
+
+def test_split_utf8_never_cuts_a_character():
+    data = ("é😀" * 100).encode()
+
+    parts = split_utf8(data, 7)
+
+    assert "".join(parts) == data.decode()
+    assert all(len(part.encode()) <= 7 for part in parts)
+
+
+def test_oversized_payload_reaches_other_workers():
+    notifications = []
+    publisher = PostgresBackplane("postgresql://unused")
+    publisher._pool = FakePool(notifications)
+    subscriber = PostgresBackplane("postgresql://unused")
+    received = []
+    subscriber.subscribe(lambda channel, frame: received.append((channel, frame.text)))
+    text = json.dumps({"type": "message", "content": "long text é " * 2000})
+
+    asyncio.run(publisher.publish("room:7", Frame(text)))
+    for payload in notifications:
+        subscriber._on_notify(None, 0, "chat_events", payload)
+
+    assert len(notifications) > 1
+    assert received == [("room:7", text)]
@@ -0,0 +1,35 @@
+import asyncio
+
+from app.connection_manager import SLOW_CONSUMER_CLOSE_CODE, Connection
+from app.frames import Frame
+
+
+class StalledWebSocket:
+    """Accepts frames but never finishes sending them."""
+
+    def __init__(self):
+        self.close_codes = []
+
+    async def send_text(self, text: str):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int = 1000):
+        self.close_codes.append(code)
+
+
+def test_send_closes_instead_of_waiting_on_full_queue():
+    async def scenario():
+        websocket = StalledWebSocket()
+        connection = Connection(websocket, user_id=1, subscriptions=set(), queue_size=1)
+        frame = Frame.from_payload({"type": "ping"})
+        # The writer takes the first frame and stalls on it, the second
+        # fills the queue, the third has nowhere to go.
+        for _ in range(3):
+            await asyncio.wait_for(connection.send(frame), timeout=1)
+            await asyncio.sleep(0)
+        return connection, websocket
+
+    connection, websocket = asyncio.run(scenario())
+
+    assert connection.closed
+    assert websocket.close_codes == [SLOW_CONSUMER_CLOSE_CODE]
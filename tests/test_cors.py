@@ -0,0 +1,14 @@
+from conftest import auth_header
+
+
+def test_browser_clients_can_read_the_next_cursor(client, make_user):
+    alice = make_user("alice_cors")
+    token = auth_header(alice)["Authorization"].split()[1]
+
+    response = client.get(
+        "/home", headers={"authorization": token, "Origin": "http://localhost:5173"}
+    )
+
+    assert response.status_code == 200
+    exposed = response.headers["access-control-expose-headers"].lower()
+    assert "x-next-cursor" in exposed
@@ -0,0 +1,63 @@
+from conftest import auth_header
+
+
+def _get_groups(client, user, etag=None, **params):
+    headers = auth_header(user)
+    if etag:
+        headers["If-None-Match"] = etag
+    return client.get("/getgroups", params=params, headers=headers)
+
+
+def test_groups_etag_holds_until_a_room_changes(client, make_user, make_room):
+    alice = make_user("alice_etag")
+    bob = make_user("bob_etag")
+    room = make_room("etag", alice)
+
+    first = _get_groups(client, alice)
+    etag = first.headers["ETag"]
+    repeat = _get_groups(client, alice, etag)
+    client.post("/joingroup", json={"room_id": room.id}, headers=auth_header(bob))
+    changed = _get_groups(client, alice, etag)
+
+    assert first.status_code == 200
+    assert repeat.status_code == 304
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_groups_etag_only_covers_the_rooms_listed(client, make_user, make_room):
+    alice = make_user("alice_etag_scope")
+    bob = make_user("bob_etag_scope")
+    mine = make_room("etag mine", alice)
+    elsewhere = make_room("etag elsewhere", bob)
+
+    etag = _get_groups(client, alice, mine=True).headers["ETag"]
+    first_page = _get_groups(client, alice, after=mine.id - 1, limit=1)
+    client.post(
+        "/joingroup",
+        json={"room_id": elsewhere.id},
+        headers=auth_header(make_user("carol_etag_scope")),
+    )
+
+    assert _get_groups(client, alice, etag, mine=True).status_code == 304
+    assert (
+        _get_groups(
+            client, alice, first_page.headers["ETag"], after=mine.id - 1, limit=1
+        ).status_code
+        == 304
+    )
+
+
+def test_groups_carry_who_is_online(client, make_user, make_room):
+    alice = make_user("alice_online")
+    room = make_room("online", alice)
+    token = auth_header(alice)["Authorization"].split()[1]
+    etag = _get_groups(client, alice, mine=True).headers["ETag"]
+
+    with client.websocket_connect(f"/chat/{room.id}?token={token}"):
+        online = _get_groups(client, alice, etag, mine=True)
+
+    (listed,) = online.json()["rooms"]
+    assert online.status_code == 200
+    assert listed["online_count"] == 1
+    assert _get_groups(client, alice, mine=True).json()["rooms"][0]["online_count"] == 0
@@ -0,0 +1,71 @@
+from conftest import auth_header
+
+from database.models import Message
+
+
+def _page_through(client, url: str, headers: dict, limit: int) -> list[int]:
+    ids, before = [], None
+    for _ in range(100):
+        params = {"limit": limit}
+        if before:
+            params["before"] = before
+        response = client.get(url, params=params, headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+        ids = [message["message_id"] for message in body["messages"]] + ids
+        before = body["next_cursor"]
+        if before is None:
+            return ids
+    raise AssertionError("history pagination did not terminate")
+
+
+def test_room_history_pages_through_whole_room(client, db, make_user, make_room):
+    alice = make_user("alice_history")
+    room = make_room("history", alice)
+    # sent_at is left to the database, so every row shares a timestamp
+    messages = [
+        Message(content=f"m{i}", sender_id=alice.id, room_id=room.id)
+        for i in range(23)
+    ]
+    db.add_all(messages)
+    db.commit()
+
+    ids = _page_through(
+        client, f"/chatroom/{room.id}/messages", auth_header(alice), limit=5
+    )
+
+    assert ids == sorted(message.id for message in messages)
+
+
+def test_room_history_rejects_invalid_cursor(client, make_user, make_room):
+    alice = make_user("alice_cursor")
+    room = make_room("cursor", alice)
+
+    response = client.get(
+        f"/chatroom/{room.id}/messages",
+        params={"before": "not-a-cursor"},
+        headers=auth_header(alice),
+    )
+
+    assert response.status_code == 400
+
+
+def test_dm_history_pages_through_whole_conversation(client, db, make_user):
+    alice = make_user("alice_dm")
+    bob = make_user("bob_dm")
+    messages = [
+        Message(
+            content=f"d{i}",
+            sender_id=(alice, bob)[i % 2].id,
+            receiver_id=(bob, alice)[i % 2].id,
+        )
+        for i in range(17)
+    ]
+    db.add_all(messages)
+    db.commit()
+
+    ids = _page_through(
+        client, f"/userchat/{bob.id}/messages", auth_header(alice), limit=4
+    )
+
+    assert ids == sorted(message.id for message in messages)
@@ -0,0 +1,75 @@
+import asyncio
+import os
+
+from conftest import auth_header
+
+from app.config import THUMBNAIL_SIZES
+from app.routes.chats import UPLOAD_FOLDER
+from app.routes.profile import UPLOAD_PROFILE_DIR
+from app.thumbnails import ThumbnailPipeline
+from database.models import Attachment
+
+SMALL = str(THUMBNAIL_SIZES[0])
+
+
+def _stored_image(db, directory: str, name: str) -> str:
+    filename = f"{name}.png"
+    db.add(
+        Attachment(
+            directory=directory,
+            sha256=name.ljust(64, "0"),
+            filename=filename,
+            size=1,
+            content_type="image/png",
+            thumbnails={SMALL: f"/uploads/thumbnails/{name}_{SMALL}.jpg"},
+        )
+    )
+    db.commit()
+    return filename
+
+
+def test_groups_carry_the_small_room_image(client, db, make_user, make_room):
+    alice = make_user("alice_thumbs")
+    room = make_room("thumbs", alice)
+    room.image = _stored_image(db, UPLOAD_FOLDER, "roomimage")
+    db.commit()
+
+    response = client.get(
+        "/getgroups", params={"mine": True}, headers=auth_header(alice)
+    )
+
+    (listed,) = response.json()["rooms"]
+    assert listed["image_url"] == "roomimage.png"
+    assert listed["image_thumbnail_url"] == f"/uploads/thumbnails/roomimage_{SMALL}.jpg"
+
+
+def test_profile_carries_the_small_profile_image(client, db, make_user):
+    bob = make_user("bob_thumbs")
+    bob.profile_image = _stored_image(db, UPLOAD_PROFILE_DIR, "bobface")
+    db.commit()
+
+    response = client.get("/profile/", headers=auth_header(bob))
+
+    assert response.json()["profile_image_thumbnail"].endswith(
+        f"/uploads/thumbnails/bobface_{SMALL}.jpg"
+    )
+
+
+def test_video_poster_is_written_under_a_part_name(tmp_path):
+    # Stand-in for ffmpeg: records its output path and writes a frame there
+    log = tmp_path / "outputs"
+    fake = tmp_path / "ffmpeg"
+    fake.write_text(
+        f'#!/bin/sh\nfor last; do :; done\necho "$last" >> "{log}"\n'
+        'echo frame > "$last"\n'
+    )
+    fake.chmod(0o755)
+    pipeline = ThumbnailPipeline()
+    pipeline._ffmpeg = str(fake)
+
+    poster = asyncio.run(pipeline._poster("clip.mp4", "clip"))
+
+    (output,) = log.read_text().split()
+    assert output.endswith(".part")
+    assert os.path.exists(poster)
+    assert not os.path.exists(output)
@@ -0,0 +1,46 @@
+from conftest import auth_header
+
+from app.backplane import InMemoryBackplane, backplane
+from app.membership import MembershipCache
+from database.models import RoomMembers
+
+
+def test_join_and_leave_reach_other_workers(client, db, make_user, make_room):
+    alice = make_user("alice_member")
+    bob = make_user("bob_member")
+    room = make_room("members", alice)
+    # A second worker sharing the backplane, with the room already cached
+    other_worker = MembershipCache(InMemoryBackplane(hub=backplane.hub))
+    assert bob.id not in other_worker.members(room.id, db)
+
+    response = client.post(
+        "/joingroup", json={"room_id": room.id}, headers=auth_header(bob)
+    )
+    assert response.status_code == 200
+    assert other_worker.members(room.id, db)[bob.id] is False
+
+    response = client.post(f"/leftchat/{room.id}", headers=auth_header(bob))
+    assert response.status_code == 200
+    assert bob.id not in other_worker.members(room.id, db)
+
+
+def test_load_racing_a_join_is_not_cached(db, make_user, make_room):
+    alice = make_user("alice_race")
+    bob = make_user("bob_race")
+    room = make_room("race", alice)
+    cache = MembershipCache(InMemoryBackplane())
+
+    class JoinDuringLoad:
+        # Reads the members, then lets bob's join commit and its event land
+        # before the load stores what it read
+        def execute(self, statement):
+            result = db.execute(statement)
+            rows = result.all()
+            db.add(RoomMembers(user_id=bob.id, room_id=room.id))
+            db.commit()
+            cache.add(room.id, bob.id)
+            result.all = lambda: rows
+            return result
+
+    assert bob.id not in cache.members(room.id, JoinDuringLoad())
+    assert bob.id in cache.members(room.id, db)
@@ -0,0 +1,65 @@
+import asyncio
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.config import DATABASE_URL
+from app.database import to_async_url
+from app.message_writer import MessageWriter
+
+
+def _run_with_writer(scenario):
+    async def run():
+        engine = create_async_engine(to_async_url(DATABASE_URL))
+        writer = MessageWriter(
+            flush_ms=50,
+            session_factory=async_sessionmaker(
+                engine, class_=AsyncSession, expire_on_commit=False
+            ),
+        )
+        try:
+            return await scenario(writer)
+        finally:
+            await writer.stop()
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_bad_row_only_fails_its_own_caller(make_user, make_room):
+    alice = make_user("alice_writer")
+    room = make_room("writer", alice)
+
+    async def scenario(writer):
+        return await asyncio.gather(
+            writer.submit(content="hello", sender_id=alice.id, room_id=room.id),
+            writer.submit(content=None, sender_id=alice.id, room_id=room.id),
+            writer.submit(content="again", sender_id=alice.id, room_id=room.id),
+            return_exceptions=True,
+        )
+
+    good, bad, again = _run_with_writer(scenario)
+
+    assert isinstance(bad, IntegrityError)
+    assert good["id"] < again["id"]
+
+
+def test_stop_writes_queued_messages(make_user, make_room):
+    alice = make_user("alice_stop")
+    room = make_room("stop", alice)
+
+    async def scenario(writer):
+        pending = [
+            asyncio.ensure_future(
+                writer.submit(content=f"m{i}", sender_id=alice.id, room_id=room.id)
+            )
+            for i in range(5)
+        ]
+        await asyncio.sleep(0)
+        await writer.stop()
+        return await asyncio.wait_for(asyncio.gather(*pending), timeout=1)
+
+    results = _run_with_writer(scenario)
+
+    assert len({result["id"] for result in results}) == 5
+
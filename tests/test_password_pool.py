@@ -0,0 +1,38 @@
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.password_pool import PasswordPool
+
+
+@pytest.fixture
+def pool():
+    pool = PasswordPool(workers=1, max_pending=4, timeout=30)
+    yield pool
+    pool.stop()
+
+
+def test_crashed_worker_is_replaced(pool):
+    with pytest.raises(HTTPException) as info:
+        pool.run_sync(os._exit, 1)
+
+    assert info.value.status_code == 503
+    assert pool.run_sync(abs, -3) == 3
+    assert pool._pending == 0
+
+
+def test_timed_out_job_holds_its_slot_until_it_finishes(pool):
+    pool.run_sync(abs, -1)
+    pool.timeout = 0.2
+
+    with pytest.raises(HTTPException) as info:
+        pool.run_sync(time.sleep, 1)
+
+    assert info.value.status_code == 503
+    assert pool._pending == 1
+    deadline = time.monotonic() + 5
+    while pool._pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pool._pending == 0
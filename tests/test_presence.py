@@ -0,0 +1,73 @@
+import asyncio
+
+from app.backplane import InMemoryBackplane, InMemoryHub
+from app.presence import RoomPresence
+
+
+def _workers(count: int, heartbeat: float = 60) -> list[RoomPresence]:
+    hub = InMemoryHub()
+    return [RoomPresence(InMemoryBackplane(hub), heartbeat) for _ in range(count)]
+
+
+def test_users_count_once_across_workers():
+    async def scenario():
+        first, second = workers = _workers(2)
+        for worker in workers:
+            worker.start()
+        first.join(7, 1)
+        first.join(7, 1)
+        second.join(7, 1)
+        second.join(7, 2)
+        await asyncio.sleep(0.01)
+        counts = [(first.online(7), second.online(7))]
+
+        first.leave(7, 1)
+        second.leave(7, 1)
+        await asyncio.sleep(0.01)
+        counts.append((first.online(7), second.online(7)))
+
+        first.leave(7, 1)
+        await asyncio.sleep(0.01)
+        counts.append((first.online(7), second.online(7)))
+        for worker in workers:
+            await worker.stop()
+        return counts
+
+    assert asyncio.run(scenario()) == [(2, 2), (2, 2), (1, 1)]
+
+
+def test_late_workers_catch_up_and_silent_ones_expire():
+    async def scenario():
+        first, second = _workers(2, heartbeat=0.05)
+        # Joined before the second worker's sender ran, as at startup
+        first.start()
+        second.join(3, 9)
+        await asyncio.sleep(0.01)
+        before = first.online(3)
+        second.start()
+        await asyncio.sleep(0.01)
+        caught_up = first.online(3)
+        # Crashed: no more heartbeats, and no farewell
+        second._task.cancel()
+        await asyncio.sleep(0.3)
+        expired = first.online(3)
+        await first.stop()
+        return before, caught_up, expired
+
+    assert asyncio.run(scenario()) == (0, 1, 0)
+
+
+def test_stopping_takes_a_workers_users_offline():
+    async def scenario():
+        first, second = _workers(2)
+        first.start()
+        second.start()
+        second.join(4, 5)
+        await asyncio.sleep(0.01)
+        online = first.online(4)
+        await second.stop()
+        offline = first.online(4)
+        await first.stop()
+        return online, offline
+
+    assert asyncio.run(scenario()) == (1, 0)
@@ -0,0 +1,48 @@
+import hashlib
+import os
+
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.main import app
+from app.routes import auth
+from database.models import Attachment, User
+
+
+def test_failed_registration_releases_profile_image(db, monkeypatch):
+    async def hash_while_someone_takes_the_username(password: str) -> str:
+        with SessionLocal() as other:
+            other.add(
+                User(
+                    username="racer",
+                    first_name="Other",
+                    last_name="Racer",
+                    email="other-racer@example.com",
+                    password="not-a-hash",
+                )
+            )
+            other.commit()
+        return "not-a-hash"
+
+    monkeypatch.setattr(
+        auth, "hash_password_async", hash_while_someone_takes_the_username
+    )
+    client = TestClient(app, raise_server_exceptions=False)
+    image = b"not really a png"
+
+    response = client.post(
+        "/register",
+        data={
+            "username": "racer",
+            "first_name": "Late",
+            "last_name": "Racer",
+            "email": "late-racer@example.com",
+            "password": "secret1",
+        },
+        files={"profile_image": ("me.png", image, "image/png")},
+    )
+
+    sha256 = hashlib.sha256(image).hexdigest()
+    assert response.status_code == 500
+    assert db.query(Attachment).filter_by(sha256=sha256).count() == 0
+    assert not os.path.exists(os.path.join(auth.UPLOAD_DIR, f"{sha256}.png"))
@@ -0,0 +1,65 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.config import DATABASE_URL
+from app.database import to_async_url
+from app.message_writer import MessageWriter
+from app.watermarks import mark_room_read
+from database.models import Message, ReadWatermark
+
+
+def _write_from_two_writers(room_id: int, sender_ids: list[int]) -> list[dict]:
+    async def run():
+        engine = create_async_engine(to_async_url(DATABASE_URL))
+        sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        writers = [MessageWriter(flush_ms=5, session_factory=sessions) for _ in range(2)]
+        try:
+            return await asyncio.gather(
+                *(
+                    writers[i % 2].submit(
+                        content=f"m{i}", sender_id=sender_ids[i % 2], room_id=room_id
+                    )
+                    for i in range(20)
+                )
+            )
+        finally:
+            for writer in writers:
+                await writer.stop()
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_interleaved_writers_number_the_room_in_order(db, make_user, make_room):
+    alice = make_user("alice_positions")
+    bob = make_user("bob_positions")
+    room = make_room("positions", alice, bob)
+
+    _write_from_two_writers(room.id, [alice.id, bob.id])
+
+    messages = db.query(Message).filter_by(room_id=room.id).order_by(Message.id).all()
+    assert [message.room_seq for message in messages] == list(range(1, 21))
+    # Each sender has read up to the position of their own last message
+    for user in (alice, bob):
+        watermark = db.query(ReadWatermark).filter_by(
+            user_id=user.id, kind="room", target_id=room.id
+        ).one()
+        last_own = [m for m in messages if m.sender_id == user.id][-1]
+        assert watermark.read_count == last_own.room_seq
+
+
+def test_marking_read_up_to_a_message_uses_its_position(db, make_user, make_room):
+    alice = make_user("alice_read_up_to")
+    bob = make_user("bob_read_up_to")
+    room = make_room("read up to", alice, bob)
+    _write_from_two_writers(room.id, [alice.id, alice.id])
+    ids = [
+        message_id
+        for (message_id,) in db.query(Message.id)
+        .filter_by(room_id=room.id)
+        .order_by(Message.id)
+    ]
+
+    assert mark_room_read(db, bob.id, room.id, ids[7]) == 12
+    assert mark_room_read(db, bob.id, room.id) == 0
@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import json
+
+import pytest
+from conftest import auth_header
+from starlette.websockets import WebSocketDisconnect
+
+from app.routes import communication
+from database.models import Attachment
+
+
+def _connect(client, user, room):
+    token = auth_header(user)["Authorization"].split()[1]
+    return client.websocket_connect(f"/chat/{room.id}?token={token}")
+
+
+def _skip_join_frames(socket):
+    pending = {"history_cursor", "is online"}
+    while pending:
+        text = socket.receive_text()
+        pending = {marker for marker in pending if marker not in text}
+
+
+@pytest.mark.parametrize(
+    "begin",
+    [
+        {"size": 10},
+        {"filename": "a.txt", "size": "lots"},
+        {"filename": "a.txt", "size": -1},
+        {"filename": ["a.txt"]},
+    ],
+)
+def test_malformed_upload_begin_keeps_the_socket(client, make_user, make_room, begin):
+    alice = make_user(f"alice_begin_{len(json.dumps(begin))}")
+    room = make_room("begin", alice)
+    with _connect(client, alice, room) as socket:
+        _skip_join_frames(socket)
+        socket.send_text(json.dumps({"type": "upload_begin", **begin}))
+        assert json.loads(socket.receive_text())["type"] == "upload_error"
+
+        socket.send_text(json.dumps({"type": "upload_begin", "filename": "a.txt"}))
+        assert json.loads(socket.receive_text())["type"] == "upload_ready"
+
+
+def test_failed_message_insert_releases_the_upload(
+    client, db, make_user, make_room, monkeypatch
+):
+    async def insert_fails(*args, **kwargs):
+        raise RuntimeError("insert failed")
+
+    monkeypatch.setattr(communication, "store_and_return_message", insert_fails)
+    alice = make_user("alice_upload_release")
+    room = make_room("release", alice)
+    blob = b"never stored as a message"
+
+    with pytest.raises(RuntimeError), _connect(client, alice, room) as socket:
+        _skip_join_frames(socket)
+        socket.send_text(
+            json.dumps(
+                {
+                    "type": "file",
+                    "filename": "note.txt",
+                    "mimetype": "text/plain",
+                    "data": "data:text/plain;base64," + base64.b64encode(blob).decode(),
+                }
+            )
+        )
+        with pytest.raises(WebSocketDisconnect):
+            socket.receive_text()
+
+    sha256 = hashlib.sha256(blob).hexdigest()
+    assert db.query(Attachment).filter_by(sha256=sha256).count() == 0
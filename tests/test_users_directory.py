@@ -0,0 +1,32 @@
+import json
+
+from conftest import auth_header
+
+
+def test_pages_name_the_next_cursor_to_browser_clients(client, make_user):
+    make_user("dir_a")
+    make_user("dir_b")
+
+    response = client.get(
+        "/users", params={"limit": 1}, headers={"Origin": "http://localhost:5173"}
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert response.headers["x-next-cursor"] == str(response.json()[0]["id"])
+    exposed = response.headers["access-control-expose-headers"].lower()
+    assert "x-next-cursor" in exposed
+
+
+def test_ndjson_export_requires_authentication(client, make_user):
+    reader = make_user("dir_reader")
+
+    assert client.get("/users", params={"format": "ndjson"}).status_code == 401
+
+    response = client.get(
+        "/users", params={"format": "ndjson"}, headers=auth_header(reader)
+    )
+
+    assert response.status_code == 200
+    usernames = [json.loads(line)["username"] for line in response.text.splitlines()]
+    assert "dir_reader" in usernames